@@ -0,0 +1,241 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# end-to-end benchmark against bench.server.StandInServer, run from the repo root:
+#   python -m bench.bench_e2e --concurrency 1 8 32 --sizes 800 2000 4000 -o results.json
+#   python -m bench.bench_e2e --compare results.json
+
+def make_image(width, height, fmt='PNG', seed=0):
+    from PIL import Image, ImageDraw
+
+    # dark "text lines" on white, roughly what screenshots and scans look like
+    rnd = random.Random(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, height // 60)
+    for top in range(line_height, height - line_height, line_height * 2):
+        left = rnd.randint(0, width // 10)
+        while left < width * 0.9:
+            word = rnd.randint(line_height, line_height * 6)
+            draw.rectangle([left, top, left + word, top + line_height], fill=(rnd.randint(0, 60),) * 3)
+            left += word + line_height
+    output = io.BytesIO()
+    image.save(output, format=fmt)
+    return output.getvalue()
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def peak_rss_kib():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def stage_cpu(scenario, image):
+    # cpu seconds of the main pipeline stages, measured in isolation on the same inputs
+    from aiohttp import FormData
+    from src.core import parse_response
+    from src.preprocess import prepare_image
+    from bench.fixtures import make_page
+
+    page = make_page(scenario['segments'], scenario['padding'])
+    runs = 5
+    stages = {}
+
+    start = time.process_time()
+    for _ in range(runs):
+        prepared = prepare_image(image)
+    stages['prepare'] = (time.process_time() - start) / runs
+
+    start = time.process_time()
+    for _ in range(runs):
+        formdata = FormData()
+        formdata.add_field('encoded_image', prepared.data, filename='image.jpg', content_type=prepared.mime)
+        formdata()
+    stages['multipart'] = (time.process_time() - start) / runs
+
+    start = time.process_time()
+    for _ in range(runs):
+        parse_response(page)
+    stages['parse'] = (time.process_time() - start) / runs
+
+    return stages
+
+async def run_client(scenario):
+    from src.index import Lens
+    from src.core import LensError
+    from src.transport import Transport
+    from bench.server import local_fetch
+
+    image = make_image(scenario['size'], scenario['size'] * 3 // 4, scenario['format'])
+    directory = tempfile.mkdtemp(prefix='lens-bench-')
+    path = os.path.join(directory, f'image.{scenario["format"].lower()}')
+    with open(path, 'wb') as f:
+        f.write(image)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(scenario['concurrency'])
+
+    async with Transport(limit_per_host=scenario['concurrency']) as transport:
+        # every request scans the same image, coalescing would turn them into one upload
+        lens = Lens({'scheduler': None, 'executor': scenario['executor'], 'coalesce': False}, local_fetch(transport, scenario['url']))
+
+        async def one(index):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    if scenario['mode'] == 'file':
+                        await lens.scan_by_file(path)
+                    elif scenario['mode'] == 'buffer':
+                        await lens.scan_by_buffer(image)
+                    else:
+                        await lens.scan_by_url(f'https://example.com/image-{index}.png', [scenario['size'], scenario['size'] * 3 // 4])
+                except LensError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(scenario['requests'])))
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    os.remove(path)
+    os.rmdir(directory)
+
+    return {
+        **{key: scenario[key] for key in ('mode', 'size', 'format', 'concurrency', 'requests', 'executor')},
+        'image_bytes': len(image),
+        'errors': errors,
+        'wall_s': wall,
+        'req_per_s': scenario['requests'] / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'cpu_s': cpu,
+        'cpu_ms_per_request': cpu / scenario['requests'] * 1000,
+        'stage_cpu_ms': {stage: seconds * 1000 for stage, seconds in stage_cpu(scenario, image).items()},
+        'peak_rss_kib': peak_rss_kib()
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run_suite(args):
+    from bench.server import StandInServer
+    from bench.fixtures import load_pages
+
+    pages = [page for _, page in load_pages(args.pages)] if args.pages else None
+    server = StandInServer(pages, args.segments, args.padding, args.latency / 1000, args.jitter / 1000, args.error_rate)
+
+    scenarios = []
+    async with server:
+        for mode in args.modes:
+            for size in args.sizes:
+                for concurrency in args.concurrency:
+                    scenario = {
+                        'url': server.url,
+                        'mode': mode,
+                        'size': size,
+                        'format': args.format,
+                        'concurrency': concurrency,
+                        'requests': args.requests,
+                        'executor': args.executor,
+                        'segments': args.segments,
+                        'padding': args.padding
+                    }
+                    # every scenario runs in a fresh process so cpu time and peak rss are its own
+                    process = await asyncio.create_subprocess_exec(
+                        sys.executable, '-m', 'bench.bench_e2e', '--client', json.dumps(scenario),
+                        stdout=asyncio.subprocess.PIPE
+                    )
+                    stdout, _ = await process.communicate()
+                    if process.returncode != 0:
+                        raise RuntimeError(f'Scenario failed: {scenario}')
+
+                    result = json.loads(stdout.decode().strip().splitlines()[-1])
+                    scenarios.append(result)
+                    print(json.dumps(result), file=sys.stderr)
+
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server': {'latency_ms': args.latency, 'jitter_ms': args.jitter, 'error_rate': args.error_rate, 'segments': args.segments, 'padding': args.padding},
+        'scenarios': scenarios
+    }
+
+def compare(baseline, current):
+    # prints relative change per scenario, positive req/s and negative latency are improvements
+    key = lambda s: (s['mode'], s['size'], s['format'], s['concurrency'], s.get('executor'))
+    previous = {key(s): s for s in baseline['scenarios']}
+
+    for scenario in current['scenarios']:
+        before = previous.get(key(scenario))
+        if before is None:
+            continue
+        changes = {
+            metric: round((scenario[metric] - before[metric]) / before[metric] * 100, 1)
+            for metric in ('req_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'cpu_ms_per_request', 'peak_rss_kib')
+            if before.get(metric) and scenario.get(metric) is not None
+        }
+        print(json.dumps({'scenario': dict(zip(('mode', 'size', 'format', 'concurrency', 'executor'), key(scenario))), 'change_percent': changes}))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark against a local stand-in Lens server.')
+    parser.add_argument('--modes', nargs='+', default=['buffer', 'file', 'url'], choices=['buffer', 'file', 'url'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[800, 2000, 4000], help='image widths in pixels')
+    parser.add_argument('--format', default='PNG', choices=['PNG', 'JPEG', 'BMP', 'TIFF', 'WEBP'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=64, help='requests per scenario')
+    parser.add_argument('--executor', choices=['thread', 'process'], default=None)
+    parser.add_argument('--pages', help='directory with recorded response pages (*.html)')
+    parser.add_argument('--segments', type=int, default=50)
+    parser.add_argument('--padding', type=int, default=200000)
+    parser.add_argument('--latency', type=float, default=50, help='server latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=10, help='server latency jitter in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    parser.add_argument('--compare', help='baseline results file to compare against')
+    parser.add_argument('--client', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.client:
+        print(json.dumps(asyncio.run(run_client(json.loads(args.client)))))
+        return
+
+    results = asyncio.run(run_suite(args))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import name -> (default budget in ms, modules that must not be imported with it)
+TARGETS = {
+    # the package itself, heavy dependencies load with the first scan
+    'src.index': (200, ['aiohttp', 'PIL', 'aiofiles', 'filetype', 'pyperclip']),
+    # --help, -d and url scans
+    'cli': (250, ['aiohttp', 'PIL', 'aiofiles', 'filetype', 'pyperclip']),
+    # what sharex.py needs to hand a capture to a running daemon
+    'src.daemon_client': (60, ['asyncio', 'aiohttp', 'PIL', 'src.core'])
+}
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package", nested imports indented
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def measure(target):
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'import {target} failed:\n{process.stderr}')
+
+    modules = parse_importtime(process.stderr)
+    total = next(cumulative for name, _, cumulative in reversed(modules) if name == target)
+    return total, modules
+
+def run_target(target, budget_ms, forbidden, repeat, top):
+    totals = []
+    for _ in range(repeat):
+        total, modules = measure(target)
+        totals.append(total)
+
+    names = {name for name, _, _ in modules}
+    imported = sorted(module for module in forbidden if module in names)
+    slowest = sorted(modules, key=lambda module: module[1], reverse=True)[:top]
+
+    median_ms = statistics.median(totals) / 1000
+    return {
+        'target': target,
+        'median_ms': round(median_ms, 1),
+        'min_ms': round(min(totals) / 1000, 1),
+        'budget_ms': budget_ms,
+        'modules': len(names),
+        'forbidden_imported': imported,
+        'slowest_self_ms': {name: round(self_us / 1000, 2) for name, self_us, _ in slowest},
+        'ok': median_ms <= budget_ms and not imported
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Import time of the package entry points against a budget, exits 1 when over.')
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument('--budget', type=float, nargs='+', help='budgets in ms, one per target, overriding the defaults')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per target, the median is compared')
+    parser.add_argument('--top', type=int, default=5, help='slowest modules (self time) to report')
+    args = parser.parse_args(argv)
+
+    if args.budget and len(args.budget) != len(args.targets):
+        parser.error('--budget needs one value per target')
+
+    failed = []
+    for i, target in enumerate(args.targets):
+        budget_ms, forbidden = TARGETS[target]
+        if args.budget:
+            budget_ms = args.budget[i]
+
+        row = run_target(target, budget_ms, forbidden, args.repeat, args.top)
+        print(json.dumps(row), flush=True)
+        if not row['ok']:
+            failed.append(row)
+
+    for row in failed:
+        if row['forbidden_imported']:
+            print(f"{row['target']}: imports {', '.join(row['forbidden_imported'])} at startup", file=sys.stderr)
+        if row['median_ms'] > row['budget_ms']:
+            print(f"{row['target']}: {row['median_ms']} ms over the {row['budget_ms']} ms budget", file=sys.stderr)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import shutil
+import tempfile
+import threading
+
+from bench.bench_e2e import make_image, peak_rss_kib
+
+# peak rss of scanning one big file, read into bytes vs memory mapped, run from the repo root:
+#   python -m bench.bench_ingest --formats TIFF PNG BMP --sizes 1000 6000
+
+def proc_status_kib(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def reset_peak():
+    # linux only: restart VmHWM from the current rss, so the peak belongs to the scan alone
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class AnonSampler(threading.Thread):
+    # VmHWM counts mapped file pages too, which the kernel can drop and share between
+    # processes. polls RssAnon for the private memory a copy really costs
+    def __init__(self, interval=0.001):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = proc_status_kib('RssAnon')
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            value = proc_status_kib('RssAnon')
+            if value is not None and (self.peak is None or value > self.peak):
+                self.peak = value
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak
+
+def peak_kib():
+    # VmHWM starts fresh at exec, ru_maxrss can carry over the parent's peak
+    peak = proc_status_kib('VmHWM')
+    return peak if peak is not None else peak_rss_kib()
+
+async def run_client(scenario):
+    from src.index import Lens
+    from src.transport import Transport
+    from bench.server import local_fetch
+
+    async with Transport() as transport:
+        # measured the way the numbers before coalescing were
+        lens = Lens({'scheduler': None, 'coalesce': False}, local_fetch(transport, scenario['url']))
+        reset_peak()
+        before = proc_status_kib('VmRSS')
+        anon_before = proc_status_kib('RssAnon')
+        sampler = AnonSampler()
+        sampler.start()
+
+        started = time.perf_counter()
+        if scenario['ingest'] == 'read':
+            with open(scenario['path'], 'rb') as f:
+                buffer = f.read()
+            result = await lens.scan_by_buffer(buffer)
+            del buffer
+        else:
+            result = await lens.scan_by_file(scenario['path'])
+        elapsed = time.perf_counter() - started
+        peak = peak_kib()
+        anon_peak = sampler.stop()
+
+    return {
+        'format': scenario['format'],
+        'size': scenario['size'],
+        'ingest': scenario['ingest'],
+        'file_kib': os.path.getsize(scenario['path']) // 1024,
+        'segments': len(result.segments),
+        'seconds': elapsed,
+        'peak_rss_kib': peak,
+        'scan_peak_growth_kib': peak - before if peak is not None and before is not None else None,
+        'scan_peak_anon_growth_kib': anon_peak - anon_before if anon_peak is not None and anon_before is not None else None
+    }
+
+async def run_suite(args):
+    from bench.server import StandInServer
+
+    directory = tempfile.mkdtemp(prefix='lens-ingest-')
+    rows = []
+    try:
+        async with StandInServer(segments=args.segments, padding=args.padding) as server:
+            for fmt in args.formats:
+                for size in args.sizes:
+                    path = os.path.join(directory, f'image-{size}.{fmt.lower()}')
+                    with open(path, 'wb') as f:
+                        f.write(make_image(size, size * 3 // 4, fmt))
+
+                    for ingest in ('read', 'mmap'):
+                        scenario = {'url': server.url, 'path': path, 'format': fmt, 'size': size, 'ingest': ingest}
+                        # a fresh process per scenario, peak rss only ever grows
+                        process = await asyncio.create_subprocess_exec(
+                            sys.executable, '-m', 'bench.bench_ingest', '--client', json.dumps(scenario),
+                            stdout=asyncio.subprocess.PIPE
+                        )
+                        stdout, _ = await process.communicate()
+                        if process.returncode != 0:
+                            raise RuntimeError(f'Scenario failed: {scenario}')
+
+                        row = json.loads(stdout.decode().strip().splitlines()[-1])
+                        rows.append(row)
+                        print(json.dumps(row), flush=True)
+
+                    os.remove(path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return rows
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Peak memory of file ingestion, read into memory vs memory mapped.')
+    parser.add_argument('--formats', nargs='+', default=['TIFF', 'PNG', 'BMP'], choices=['TIFF', 'PNG', 'BMP', 'JPEG', 'WEBP'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 6000], help='image widths in pixels')
+    parser.add_argument('--segments', type=int, default=50)
+    parser.add_argument('--padding', type=int, default=200000)
+    parser.add_argument('--client', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.client:
+        print(json.dumps(asyncio.run(run_client(json.loads(args.client)))))
+        return
+
+    asyncio.run(run_suite(args))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
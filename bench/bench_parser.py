@@ -0,0 +1,76 @@
+import re
+import sys
+import json
+import time
+import argparse
+
+from src import af_parser
+from bench.fixtures import make_page, load_pages
+
+def legacy_replace_keys(text):
+    pattern = r"(\w+):\s*(?:'[^']*'|\{[^}]*\}|\[[^\]]*\])"
+    matches = re.findall(pattern, text)
+    for m in matches:
+        text = text.replace(m, f"'{m}'")
+    return text
+
+def legacy_get_af_data(text):
+    # the regex + eval implementation LensCore.get_af_data used before af_parser
+    callbacks = re.findall(r'AF_initDataCallback\((\{.*?\})\)', text, re.DOTALL)
+    lens_callback = next((c for c in callbacks if 'DetectedObject' in c), None)
+
+    if not lens_callback:
+        raise ValueError('Could not find matching AF_initDataCallback')
+
+    capitalize_string = re.sub(r"(false|true)", lambda m: m.group(1).capitalize(), lens_callback)
+    matched = legacy_replace_keys(capitalize_string.replace("null", "None"))
+    return eval(matched)
+
+IMPLEMENTATIONS = {
+    'legacy': legacy_get_af_data,
+    'af_parser': af_parser.get_af_data
+}
+
+def measure(fn, text, min_time):
+    runs = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < min_time:
+        fn(text)
+        runs += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / runs
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Compare AF_initDataCallback parser throughput.')
+    parser.add_argument('--pages', help='directory with recorded response pages (*.html)')
+    parser.add_argument('--segments', type=int, nargs='+', default=[10, 100, 1000], help='segment counts for synthetic pages')
+    parser.add_argument('--padding', type=int, default=200000, help='bytes of unrelated html in synthetic pages')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to run each measurement')
+    args = parser.parse_args(argv)
+
+    if args.pages:
+        pages = load_pages(args.pages)
+    else:
+        pages = [(f'synthetic-{n}', make_page(n, args.padding)) for n in args.segments]
+
+    results = []
+    for name, text in pages:
+        row = {'page': name, 'bytes': len(text.encode())}
+        outputs = {}
+        for impl, fn in IMPLEMENTATIONS.items():
+            try:
+                seconds = measure(fn, text, args.min_time)
+                outputs[impl] = fn(text)
+                row[impl] = {'ms': round(seconds * 1000, 3), 'mb_per_s': round(row['bytes'] / seconds / 1e6, 2)}
+            except Exception as e:
+                row[impl] = {'error': str(e)}
+        if len(outputs) == 2:
+            row['same_output'] = outputs['legacy'] == outputs['af_parser']
+        results.append(row)
+        print(json.dumps(row))
+
+    return results
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,37 @@
+import json
+import random
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'eiusmod', 'tempor', 'incididunt']
+
+def make_page(segments=50, padding=200000, language='en', seed=0):
+    # synthetic stand-in for a recorded lens.google.com response page,
+    # shaped like the parts parse_result reads (method 1 layout)
+    rnd = random.Random(seed)
+
+    texts = [' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 8))) for _ in range(segments)]
+    regions = []
+    for i in range(segments):
+        box = [round(rnd.uniform(0.1, 0.9), 6), round((i + 0.5) / segments, 6), round(rnd.uniform(0.05, 0.5), 6), round(0.8 / segments, 6)]
+        regions.append([None, box, None, None, None, None, None, None, None, None, None, f'text:{i}'])
+
+    data = [['DetectedObject', None], None, [None, None, None, [regions]], [None, None, None, language, [[texts]]]]
+
+    filler = ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz <>/="') for _ in range(padding))
+
+    return ''.join([
+        '<!doctype html><html><head><script nonce="bench">',
+        "AF_initDataCallback({key: 'ds:0', hash: '1', data:[\"en\", null, true, false, [1, 2, 3]], sideChannel: {}});",
+        '</script></head><body><div>', filler, '</div><script nonce="bench">',
+        f"AF_initDataCallback({{key: 'ds:1', hash: '2', data:{json.dumps(data)}, sideChannel: {{}}}});",
+        '</script></body></html>'
+    ])
+
+def load_pages(directory):
+    import os
+
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'r', encoding='utf8') as f:
+                pages.append((name, f.read()))
+    return pages
@@ -0,0 +1,148 @@
+import sys
+import random
+import asyncio
+import argparse
+from aiohttp import web
+from bench.fixtures import make_page, load_pages
+
+LENS_HOSTS = ('https://lens.google.com', 'https://consent.google.com')
+
+class StandInServer:
+    # local imitation of lens.google.com: /v3/upload, /uploadbyurl and the
+    # EU consent 302 -> POST /save -> 303 exchange
+    def __init__(self, pages=None, segments=50, padding=200000, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, consent=False, seed=0):
+        self.pages = pages or [make_page(segments, padding)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.consent = consent
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.uploads = 0
+        self.consent_redirects = 0
+        self.consent_saves = 0
+        self.errors = 0
+
+        self.url = None
+        self._runner = None
+
+    def _app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/v3/upload', self._lens)
+        app.router.add_get('/uploadbyurl', self._lens)
+        app.router.add_post('/save', self._save_consent)
+        return app
+
+    async def _delay(self):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _lens(self, request):
+        self.requests += 1
+        await request.read()
+        await self._delay()
+
+        cookie = request.headers.get('cookie', '')
+        if self.consent and ('CONSENT=YES' not in cookie or 'SOCS=' not in cookie):
+            self.consent_redirects += 1
+            raise web.HTTPFound(
+                'https://consent.google.com/ml?continue=https://lens.google.com/&gl=DE&m=0&pc=l&cm=2&hl=en&src=1',
+                headers={'Set-Cookie': 'NID=511=pending; expires=Sat, 01-Jan-2050 00:00:00 GMT; path=/; domain=.google.com'}
+            )
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=self.error_status, text='<html>throttled</html>', content_type='text/html')
+
+        self.uploads += 1
+        return web.Response(
+            text=self.random.choice(self.pages),
+            content_type='text/html',
+            headers={'Set-Cookie': 'NID=511=standin; expires=Sat, 01-Jan-2050 00:00:00 GMT; path=/; domain=.google.com'}
+        )
+
+    async def _save_consent(self, request):
+        self.consent_saves += 1
+        await request.read()
+        await self._delay()
+
+        # two cookies in one response, like the real consent save
+        redirect = web.HTTPSeeOther('https://lens.google.com/')
+        redirect.headers.add('Set-Cookie', 'CONSENT=YES+cb.20240129-02-p0.en+FX+410; expires=Sat, 01-Jan-2050 00:00:00 GMT; path=/; domain=.google.com')
+        redirect.headers.add('Set-Cookie', 'SOCS=CAESHAgBEhJnd3NfMjAyNDAxMjktMF9SQzIaAmVuIAEaBgiA_LyuBg; expires=Sat, 01-Jan-2050 00:00:00 GMT; path=/; domain=.google.com')
+        raise redirect
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    @property
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'uploads': self.uploads,
+            'errors': self.errors,
+            'consent_redirects': self.consent_redirects,
+            'consent_saves': self.consent_saves
+        }
+
+def local_fetch(fetch, base_url):
+    # plugs into the fetch injection point, sends google urls to the stand-in
+    def rewrite(url):
+        for host in LENS_HOSTS:
+            if url.startswith(host):
+                return base_url + url[len(host):]
+        return url
+
+    async def rewritten(url, request_init):
+        return await fetch(rewrite(url), request_init)
+
+    # keep the streaming path of a Transport available
+    if hasattr(fetch, 'stream'):
+        async def stream(url, request_init, scanner):
+            return await fetch.stream(rewrite(url), request_init, scanner)
+        rewritten.stream = stream
+
+    return rewritten
+
+async def serve(args):
+    pages = [page for _, page in load_pages(args.pages)] if args.pages else None
+    server = StandInServer(pages, args.segments, args.padding, args.latency / 1000, args.jitter / 1000, args.error_rate, consent=args.consent)
+    url = await server.start(port=args.port)
+    print(url, flush=True)
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Google Lens upload endpoints.')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--pages', help='directory with recorded response pages (*.html)')
+    parser.add_argument('--segments', type=int, default=50)
+    parser.add_argument('--padding', type=int, default=200000)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--consent', action='store_true', help='require the consent exchange first')
+    try:
+        asyncio.run(serve(parser.parse_args(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
@@ -1,19 +1,158 @@
 import os
-import json
 import sys
+import glob
+import json
+import time
 import asyncio
-import pyperclip
 from pathlib import Path
 from urllib.parse import urlparse
 from src.index import Lens
+from src.cookie_jar import CookieJar
 
 image = None
 should_copy = True
 
+IMAGE_EXTENSIONS = ('.ico', '.bmp', '.jfif', '.pjpeg', '.jpeg', '.pjp', '.jpg', '.png', '.tif', '.tiff', '.webp', '.heic', '.gif')
+
 def asyncio_run(func):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(func)
+
+def get_cookies_path():
+    # cookies file should be in the same directory as this script
+    return Path(__file__).resolve().parent / 'cookies.json'
+
+def pop_option(args, names, default=None):
+    for name in names:
+        if name in args:
+            index = args.index(name)
+            if index + 1 >= len(args):
+                raise ValueError(f'Missing value for {name}')
+            value = args[index + 1]
+            del args[index:index + 2]
+            return value
+    return default
+
+async def expand_inputs(args):
+    # lazily, so huge directories and stdin lists are never held in memory. reads
+    # and directory listings run in a thread, scans in flight keep going while
+    # a slow producer on stdin or a big tree is waited for
+    for arg in args:
+        if arg == '-':
+            while True:
+                line = await asyncio.to_thread(sys.stdin.readline)
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    yield line
+        elif urlparse(arg).scheme in ['http', 'https']:
+            yield arg
+        elif os.path.isdir(arg):
+            walk = os.walk(arg)
+            while True:
+                entry = await asyncio.to_thread(next, walk, None)
+                if entry is None:
+                    break
+                root, dirs, files = entry
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(arg):
+            paths = await asyncio.to_thread(lambda: [path for path in sorted(glob.iglob(arg, recursive=True)) if os.path.isfile(path)])
+            for path in paths:
+                yield path
+        else:
+            yield arg
+
+def read_done_inputs(path):
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a line cut off by an interrupted run
+                continue
+            if 'error' not in record:
+                done.add(record['input'])
+    return done
+
+def trim_partial_line(path):
+    # a run killed mid-write leaves half a record at the end, cut it off so
+    # appended records start on a line of their own (its input is scanned again)
+    if not path or not os.path.exists(path):
+        return
+
+    with open(path, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline != -1:
+                position += newline + 1 - step
+                break
+            position -= step
+        if position != end:
+            f.truncate(position)
+
+async def batch(args):
+    output_path = pop_option(args, ['-o', '--output'])
+    concurrency = int(pop_option(args, ['-j', '--concurrency'], 4))
+
+    # resume: inputs already written to the output file are skipped
+    trim_partial_line(output_path)
+    done = read_done_inputs(output_path)
+    started = {}
+
+    async def pending_inputs():
+        seen = set()
+        async for source in expand_inputs(args):
+            if source in done or source in seen:
+                continue
+            seen.add(source)
+            started[source] = time.perf_counter()
+            yield source
+
+    path_to_cookies = get_cookies_path()
+    lens_options = {'headers': {'cookie': CookieJar.from_file(path_to_cookies)}, 'metrics': True}
+
+    output = open(output_path, 'a', encoding='utf8') if output_path else sys.stdout
+    scanned = 0
+    failed = 0
+
+    try:
+        async with Lens(lens_options) as lens:
+            async for source, result in lens.iter_scan(pending_inputs(), concurrency):
+                record = {'input': source}
+                if isinstance(result, Exception):
+                    record['error'] = str(result)
+                    record['code'] = result.code
+                    failed += 1
+                else:
+                    record.update(result.to_dict())
+                    record['text'] = result.text()
+                record['timings'] = {'total': time.perf_counter() - started.pop(source), 'stages': getattr(result, 'spans', [])}
+
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                output.flush()
+                scanned += 1
+
+        lens.cookies.save(path_to_cookies)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f'Scanned {scanned} images, {failed} failed, {len(done)} already in output', file=sys.stderr)
+    return scanned
+
 async def cli(args):
     global should_copy, image
 
@@ -21,6 +160,16 @@ async def cli(args):
         args.remove('-d')
         should_copy = False
 
+    is_batch = '-b' in args or '--batch' in args
+    if is_batch:
+        args = [arg for arg in args if arg not in ('-b', '--batch')]
+
+    if '--serve' in args:
+        args.remove('--serve')
+        near_duplicates = '--near-duplicates' in args
+        from src.daemon import serve
+        return await serve(pop_option(args, ['--socket']), get_cookies_path(), near_duplicates=near_duplicates)
+
     # check empty arguments at last
     if not args or '-h' in args or '--help' in args:
         print('Scan text from image using Google Lens and copy to clipboard.')
@@ -28,49 +177,57 @@ async def cli(args):
         print('USAGE:')
         print('    chrome-lens-ocr [-d] ./path/to/image.png')
         print('    chrome-lens-ocr [-d] https://domain.tld/image.png')
+        print('    chrome-lens-ocr -b [-o out.jsonl] [-j 4] ./dir "./shots/**/*.png" -')
+        print('    chrome-lens-ocr --serve [--socket /path/to.sock | 127.0.0.1:47615] [--near-duplicates]')
         print('    chrome-lens-ocr --help')
         print('ARGS:')
-        print('    -d         Do not copy text to clipboard')
-        print('    -h, --help Show this message')
+        print('    -d                  Do not copy text to clipboard')
+        print('    -b, --batch         Scan directories, globs and paths/URLs from stdin (-), one JSON line per image')
+        print('    -o, --output        Batch output file, inputs already in it are skipped')
+        print('    -j, --concurrency   Number of images scanned at once in batch mode (default 4)')
+        print('    --serve             Keep a warm scanner running for sharex.py, stop it with Ctrl+C')
+        print('    --socket            Unix socket path or host:port the daemon listens on')
+        print('    --near-duplicates   Let the daemon reuse results for captures with the same content')
+        print('    -h, --help          Show this message')
         return
 
+    if is_batch:
+        return await batch(args)
+
     # hope the last argument is the image
     image = args[0]
 
-    # get path to cookies file (should be in the same directory as this script)
-    module_url = Path(__file__).resolve()
-    path_to_cookies = module_url.parent / 'cookies.json'
+    path_to_cookies = get_cookies_path()
 
     # check file access
     # if not os.access(path_to_cookies, os.R_OK | os.W_OK):
         # print(f'Cannot write cookie, read/write permission denied in {path_to_cookies}')
         # return
 
-    # read cookies from file
-    cookie = None
-    if path_to_cookies.exists():
-        with open(path_to_cookies, 'r', encoding='utf8') as f:
-            cookie = json.load(f)
+    # read cookies from file, the jar is shared with other running instances
+    cookie = CookieJar.from_file(path_to_cookies)
 
-    # create lens instance, with cookie if exists
-    lens_options = {'headers': {'cookie': cookie}} if cookie else {}
-    lens = Lens(lens_options)
+    # create lens instance, with cookie jar
+    lens_options = {'headers': {'cookie': cookie}}
     text = None
 
-    # remove Windows drive prefix because false positive
-    if urlparse(image).scheme in ['http', 'https']:
-        text = await lens.scan_by_url(image)
-    else:
-        text = await lens.scan_by_file(image)
+    async with Lens(lens_options) as lens:
+        # remove Windows drive prefix because false positive
+        if urlparse(image).scheme in ['http', 'https']:
+            text = await lens.scan_by_url(image)
+        else:
+            text = await lens.scan_by_file(image)
 
-    result = '\n'.join(segment.text for segment in text.segments)
+    # lines in reading order, multi-column pages come out column by column
+    result = text.text()
 
-    # write cookies to file
-    with open(path_to_cookies, 'w', encoding='utf8') as f:
-        json.dump(lens.cookies, f, indent=4)
+    # write cookies to file, only if they changed
+    lens.cookies.save(path_to_cookies)
 
     # write text to clipboard
     if should_copy:
+        import pyperclip
+
         pyperclip.copy(result)
 
     print(result)
@@ -80,8 +237,11 @@ async def cli(args):
 if __name__ == '__main__':
     try:
         args = sys.argv[1:]
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        if sys.platform == 'win32':
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
         asyncio.run(cli(args))
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print('Error occurred:')
         print(e)
@@ -1,19 +1,30 @@
-import pyperclip
-import asyncio
-from src.utils import sleep
-from cli import cli
+import sys
+import time
+from src import daemon_client
 
-async def main():
+# tiny entry point for the ShareX hotkey: hand the screenshot to a running
+# daemon (cli.py --serve), and only import and run the scanner here without one
+
+def main():
+    args = sys.argv[1:]
+    source = next((arg for arg in reversed(args) if not arg.startswith('-')), None)
     try:
-        args = sys.argv[1:]
-        result = await cli(args)
+        try:
+            if source is None:
+                raise FileNotFoundError('Nothing to scan')
+            result = daemon_client.scan(source)['text']
+        except (ConnectionRefusedError, FileNotFoundError):
+            # no daemon listening, scan in this process
+            import asyncio
+            from cli import cli
+            result = asyncio.run(cli(args))
 
+        import pyperclip
         pyperclip.copy(result)
     except Exception as e:
         print('Error occurred:')
         print(e)
-        await sleep(30)
+        time.sleep(30)
 
 if __name__ == "__main__":
-    asyncio.run(main())
-
+    main()
@@ -0,0 +1,252 @@
+import re
+import json
+
+CALLBACK_PREFIX = 'AF_initDataCallback('
+LENS_MARKER = 'DetectedObject'
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'\s*')
+_identifier = re.compile(r'[A-Za-z_$][\w$]*')
+_single_quoted = re.compile(r"'((?:[^'\\]|\\.)*)'", re.DOTALL)
+_escape = re.compile(r'\\x([0-9a-fA-F]{2})|\\(.)|"', re.DOTALL)
+
+_literals = {
+    'true': True,
+    'false': False,
+    'null': None,
+    'undefined': None,
+    'NaN': float('nan'),
+    'Infinity': float('inf')
+}
+
+def _skip(text, pos):
+    return _whitespace.match(text, pos).end()
+
+def _unescape(match):
+    if match.group(1) is not None:
+        return f'\\u00{match.group(1)}'
+    char = match.group(2)
+    if char is None:
+        return '\\"'
+    if char == "'":
+        return "'"
+    return '\\' + char
+
+def _parse_single_quoted(text, pos):
+    match = _single_quoted.match(text, pos)
+    if not match:
+        raise ValueError(f'Unterminated string at position {pos}')
+
+    inner = match.group(1)
+    if '\\' not in inner and '"' not in inner:
+        return inner, match.end()
+
+    # reuse the json string decoder for escapes, after mapping js-only ones
+    return json.loads('"' + _escape.sub(_unescape, inner) + '"'), match.end()
+
+def _parse_key(text, pos):
+    char = text[pos]
+    if char == "'":
+        return _parse_single_quoted(text, pos)
+    if char == '"':
+        return _decoder.raw_decode(text, pos)
+
+    match = _identifier.match(text, pos)
+    if match:
+        return match.group(0), match.end()
+
+    # numeric keys
+    value, end = _decoder.raw_decode(text, pos)
+    return str(value), end
+
+def _parse_object(text, pos):
+    result = {}
+    pos = _skip(text, pos + 1)
+
+    while text[pos] != '}':
+        key, pos = _parse_key(text, pos)
+        pos = _skip(text, pos)
+        if text[pos] != ':':
+            raise ValueError(f'Expected ":" at position {pos}')
+
+        result[key], pos = parse_value(text, pos + 1)
+        pos = _skip(text, pos)
+
+        if text[pos] == ',':
+            pos = _skip(text, pos + 1)
+        elif text[pos] != '}':
+            raise ValueError(f'Expected "," or "}}" at position {pos}')
+
+    return result, pos + 1
+
+def _parse_array(text, pos):
+    result = []
+    pos = _skip(text, pos + 1)
+
+    while text[pos] != ']':
+        value, pos = parse_value(text, pos)
+        result.append(value)
+        pos = _skip(text, pos)
+
+        if text[pos] == ',':
+            pos = _skip(text, pos + 1)
+        elif text[pos] != ']':
+            raise ValueError(f'Expected "," or "]" at position {pos}')
+
+    return result, pos + 1
+
+def parse_value(text, pos=0):
+    # decodes one js literal starting at pos, returns (value, end position)
+    pos = _skip(text, pos)
+    if pos >= len(text):
+        raise ValueError('Unexpected end of data')
+
+    char = text[pos]
+
+    if char == '{':
+        return _parse_object(text, pos)
+
+    if char == '[':
+        # the data payload is plain json, let the c decoder handle it in one go
+        try:
+            return _decoder.raw_decode(text, pos)
+        except ValueError:
+            return _parse_array(text, pos)
+
+    if char == "'":
+        return _parse_single_quoted(text, pos)
+
+    match = _identifier.match(text, pos)
+    if match:
+        if match.group(0) not in _literals:
+            raise ValueError(f'Unexpected identifier "{match.group(0)}" at position {pos}')
+        return _literals[match.group(0)], match.end()
+
+    return _decoder.raw_decode(text, pos)
+
+def find_callback(text, marker=LENS_MARKER):
+    # single pass over the page: each callback is only parsed if the marker
+    # occurs before the next callback starts
+    start = text.find(CALLBACK_PREFIX)
+
+    while start != -1:
+        body = start + len(CALLBACK_PREFIX)
+        next_start = text.find(CALLBACK_PREFIX, body)
+        end = next_start if next_start != -1 else len(text)
+
+        if text.find(marker, body, end) != -1:
+            try:
+                value, value_end = parse_value(text, body)
+            except IndexError:
+                raise ValueError('Unexpected end of data in AF_initDataCallback')
+            if text.find(marker, body, value_end) != -1:
+                return value
+
+        start = next_start
+
+    return None
+
+def get_af_data(text):
+    af_data = find_callback(text)
+
+    if af_data is None:
+        raise ValueError('Could not find matching AF_initDataCallback')
+
+    return af_data
+
+class CallbackScanner:
+    # incremental find_callback for a page arriving in chunks: text before the
+    # current candidate callback is dropped, and feed() returns the callback's
+    # value as soon as it is complete, so the rest of the body can be skipped
+    def __init__(self, marker=LENS_MARKER):
+        self.marker = marker
+        self._buffer = ''
+        # where the next search for the marker / end of script resumes
+        self._marker_search = None
+        self._end_search = None
+        self.value = None
+
+    def _discard(self, pos):
+        self._buffer = self._buffer[pos:]
+        self._marker_search = None
+        self._end_search = None
+
+    def feed(self, chunk):
+        if self.value is not None:
+            return self.value
+        self._buffer += chunk
+        return self._scan(False)
+
+    def finish(self):
+        # end of the body, whatever is buffered has to parse now
+        if self.value is not None:
+            return self.value
+        return self._scan(True)
+
+    def _scan(self, final):
+        buffer = self._buffer
+
+        while True:
+            start = buffer.find(CALLBACK_PREFIX) if self._marker_search is None else 0
+            if start == -1:
+                # keep a tail, the prefix may be split across chunks
+                self._discard(max(0, len(buffer) - len(CALLBACK_PREFIX) + 1))
+                return None
+            if start:
+                self._discard(start)
+                buffer = self._buffer
+            body = len(CALLBACK_PREFIX)
+
+            next_start = buffer.find(CALLBACK_PREFIX, body)
+            end = next_start if next_start != -1 else len(buffer)
+            complete = next_start != -1 or final
+
+            marker_from = self._marker_search if self._marker_search is not None else body
+            if buffer.find(self.marker, marker_from, end) == -1:
+                if not complete:
+                    # inline scripts can't contain </script>, a closed one without the marker is done with
+                    script_end = buffer.find('</script>', self._end_search or body)
+                    if script_end != -1:
+                        self._discard(script_end)
+                        buffer = self._buffer
+                        continue
+                    self._marker_search = max(body, len(buffer) - len(self.marker) + 1)
+                    self._end_search = max(body, len(buffer) - len('</script>') + 1)
+                    return None
+                if next_start == -1:
+                    return None
+                self._discard(next_start)
+                buffer = self._buffer
+                continue
+            self._marker_search = body
+
+            # only try to parse once the script looks closed, not on every chunk
+            if not complete:
+                end_from = self._end_search if self._end_search is not None else body
+                if buffer.find('</script>', end_from) == -1:
+                    self._end_search = max(body, len(buffer) - len('</script>') + 1)
+                    return None
+
+            try:
+                value, value_end = parse_value(buffer, body)
+            except (IndexError, ValueError) as e:
+                if not complete:
+                    self._end_search = len(buffer)
+                    return None
+                # the same errors find_callback raises for a whole page
+                if isinstance(e, IndexError):
+                    raise ValueError('Unexpected end of data in AF_initDataCallback')
+                raise
+
+            if buffer.find(self.marker, body, value_end) != -1:
+                self.value = value
+                self._buffer = ''
+                return value
+
+            if next_start == -1:
+                # the marker was after this callback, keep scanning past it
+                self._discard(value_end)
+                buffer = self._buffer
+                continue
+            self._discard(next_start)
+            buffer = self._buffer
@@ -0,0 +1,68 @@
+import asyncio
+from .core import LensError
+
+class BatchMixin:
+    # batch helpers for anything with an async scan(source) method
+    async def _scan_item(self, source):
+        try:
+            return await self.scan(source)
+        except LensError as error:
+            return error
+        except Exception as error:
+            # per-item failures are reported instead of aborting the batch
+            lens_error = LensError(f'Could not scan {source if isinstance(source, str) else type(source).__name__}: {error}', None, None, None)
+            lens_error.__cause__ = error
+            return lens_error
+
+    async def iter_scan(self, inputs, concurrency=4, ordered=False):
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        is_async = hasattr(inputs, '__aiter__')
+        iterator = inputs.__aiter__() if is_async else iter(inputs)
+
+        # in ordered mode finished results wait for slower earlier ones,
+        # so the window of started-but-not-yielded items is capped as well
+        window = concurrency * 2 if ordered else concurrency
+
+        pending = {}
+        finished = {}
+        next_index = 0
+        next_yield = 0
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency and next_index - next_yield < window:
+                    try:
+                        source = await iterator.__anext__() if is_async else next(iterator)
+                    except (StopIteration, StopAsyncIteration):
+                        exhausted = True
+                        break
+
+                    task = asyncio.ensure_future(self._scan_item(source))
+                    pending[task] = (next_index, source)
+                    next_index += 1
+
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    index, source = pending.pop(task)
+                    if ordered:
+                        finished[index] = (source, task.result())
+                    else:
+                        next_yield += 1
+                        yield source, task.result()
+
+                while next_yield in finished:
+                    yield finished.pop(next_yield)
+                    next_yield += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def scan_many(self, inputs, concurrency=4, ordered=True):
+        return [item async for item in self.iter_scan(inputs, concurrency, ordered)]
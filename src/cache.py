@@ -0,0 +1,165 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    # content-addressed cache for scan_by_data results, an in-process LRU
+    # in front of an optional sqlite file shared between runs
+    def __init__(self, max_entries=1024, path=None, ttl=None, max_disk_entries=None):
+        if max_entries < 0:
+            raise ValueError('max_entries must not be negative')
+
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_created ON results (created)')
+            self._db.commit()
+
+    @staticmethod
+    def key(data, config):
+        # the result only depends on the uploaded bytes and the request config
+        digest = hashlib.sha256(data)
+        digest.update(f'|{config.get("endpoint")}|{config.get("viewport")}'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def dump_result(result):
+        boxes = result.boxes.tolist()
+        return {
+            'language': result.language,
+            'segments': [[text, boxes[i * 4:i * 4 + 4]] for i, text in enumerate(result.texts)]
+        }
+
+    @staticmethod
+    def load_result(data, image_dimensions):
+        from .core import LensResult
+
+        # boxes are stored as fractions, pixel coordinates follow the caller's dimensions
+        segments = data['segments']
+        return LensResult.from_columns(data['language'], [text for text, _ in segments], [box for _, box in segments], image_dimensions)
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, data = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return data
+
+                del self._memory[key]
+                self.evictions += 1
+
+            if self._db is not None:
+                row = self._db.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value, created = row
+                    if not self._expired(created, now):
+                        data = json.loads(value)
+                        self._remember(key, created, data)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return data
+
+                    self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self._db.commit()
+                    self.evictions += 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key, data):
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now, data)
+
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)', (key, json.dumps(data), now))
+                if self.max_disk_entries is not None:
+                    cursor = self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+                    self.evictions += cursor.rowcount
+                self._db.commit()
+
+    def _remember(self, key, created, data):
+        if self.max_entries == 0:
+            return
+
+        self._memory[key] = (created, data)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def purge(self):
+        # drop everything past its ttl from both tiers
+        if self.ttl is None:
+            return 0
+
+        now = time.time()
+        removed = 0
+
+        with self._lock:
+            for key in [key for key, (created, _) in self._memory.items() if self._expired(created, now)]:
+                del self._memory[key]
+                removed += 1
+
+            if self._db is not None:
+                cursor = self._db.execute('DELETE FROM results WHERE created < ?', (now - self.ttl,))
+                self._db.commit()
+                removed += cursor.rowcount
+
+            self.evictions += removed
+
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._memory)
+        }
+
+    def __len__(self):
+        return len(self._memory)
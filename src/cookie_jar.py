@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import tempfile
+import contextlib
+from .set_cookie_parser import split_cookies_string, parse as cookie_parse
+
+def parse_expiry(cookie, now=None):
+    # resolves max-age / expires to an epoch timestamp once, at insert time
+    if cookie.get('maxAge') is not None:
+        return (now or time.time()) + int(cookie['maxAge'])
+
+    expires = cookie.get('expires')
+    if expires is None:
+        return float('inf')
+    if isinstance(expires, (int, float)):
+        return float(expires)
+
+    from http.cookiejar import http2time
+
+    expires = str(expires).strip()
+    parsed = http2time(expires)
+    if parsed is not None:
+        return float(parsed)
+
+    try:
+        return float(expires)
+    except ValueError:
+        return float('inf')
+
+@contextlib.contextmanager
+def _locked(path):
+    # advisory lock on a sidecar file, so concurrent processes take turns on the jar
+    with open(f'{path}.lock', 'a+b') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf8') as f:
+            return json.load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+class CookieJar(dict):
+    def __init__(self, cookies=None):
+        super().__init__()
+        self._header = None
+        self._next_expiry = float('inf')
+        self._version = 0
+        self._saved_version = 0
+        # names removed since the last save, the copy still on disk must not come back
+        self._deleted = set()
+        if cookies:
+            self.update(cookies)
+            self._saved_version = self._version
+
+    def _changed(self):
+        self._header = None
+        self._version += 1
+
+    def __setitem__(self, name, cookie):
+        cookie = dict(cookie)
+        cookie.setdefault('name', name)
+        if 'expiresAt' not in cookie:
+            cookie['expiresAt'] = parse_expiry(cookie)
+
+        super().__setitem__(name, cookie)
+        self._deleted.discard(name)
+        self._next_expiry = min(self._next_expiry, cookie['expiresAt'])
+        self._changed()
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._deleted.add(name)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        for name, cookie in dict(*args, **kwargs).items():
+            self[name] = cookie
+
+    def setdefault(self, name, cookie=None):
+        if name not in self:
+            self[name] = cookie
+        return self[name]
+
+    def pop(self, name, *default):
+        if name in self:
+            self._deleted.add(name)
+            self._changed()
+        return super().pop(name, *default)
+
+    def popitem(self):
+        item = super().popitem()
+        self._deleted.add(item[0])
+        self._changed()
+        return item
+
+    def clear(self):
+        self._deleted.update(self)
+        super().clear()
+        self._next_expiry = float('inf')
+        self._changed()
+
+    @property
+    def changed(self):
+        return self._version != self._saved_version
+
+    def purge(self, now=None):
+        now = now or time.time()
+        # nothing can have expired before the earliest expiry seen at insert time
+        if now < self._next_expiry:
+            return 0
+
+        expired = [name for name, cookie in self.items() if cookie['expiresAt'] <= now]
+        for name in expired:
+            super().__delitem__(name)
+        # the server deletes a cookie by sending it already expired
+        self._deleted.update(expired)
+
+        self._next_expiry = min((cookie['expiresAt'] for cookie in self.values()), default=float('inf'))
+        if expired:
+            self._changed()
+        return len(expired)
+
+    def header(self):
+        self.purge()
+        if self._header is None:
+            self._header = '; '.join(f'{name}={cookie["value"]}' for name, cookie in self.items())
+        return self._header
+
+    def set_from_header(self, combined_cookie_header):
+        cookies = cookie_parse(split_cookies_string(combined_cookie_header))
+        for cookie in cookies or []:
+            self[cookie['name']] = cookie
+
+    @classmethod
+    def from_file(cls, path):
+        jar = cls()
+        jar.load(path)
+        return jar
+
+    def load(self, path):
+        with _locked(path):
+            self._merge(_read(path))
+        self._saved_version = self._version
+
+    def _merge(self, cookies):
+        # cookies another process stored are taken unless ours live longer,
+        # or we deleted them
+        for name, cookie in cookies.items():
+            if name in self._deleted:
+                continue
+            expires_at = cookie.get('expiresAt')
+            if expires_at is None:
+                expires_at = parse_expiry(cookie)
+            if name not in self or self[name]['expiresAt'] < expires_at:
+                self[name] = cookie
+
+    def save(self, path, force=False):
+        if not self.changed and not force:
+            return False
+
+        directory = os.path.dirname(os.path.abspath(path))
+
+        with _locked(path):
+            # an expired cookie still in memory is a deletion, not something to replace
+            self.purge()
+            self._merge(_read(path))
+            self.purge()
+
+            # write next to the target and swap it in, readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(prefix='.cookies-', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf8') as f:
+                    json.dump(dict(self), f, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(temp_path)
+                raise
+
+        self._deleted.clear()
+        self._saved_version = self._version
+        return True
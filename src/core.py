@@ -1,15 +1,42 @@
-import io
-import re
+import copy
 import time
-from datetime import datetime
-from aiohttp import FormData
-from PIL import Image
-from .set_cookie_parser import split_cookies_string, parse as cookie_parse
+import asyncio
+from array import array
+from collections.abc import Sequence
+from .cookie_jar import CookieJar
+from .layout import Layout, to_rects
 from .consts import LENS_API_ENDPOINT, LENS_ENDPOINT, MIME_TO_EXT, SUPPORTED_MIMES
-from .utils import parse_cookies, replace_keys, sleep
+from .transport import Transport
+from .preprocess import open_buffer
+from .executor import resolve_executor, run_cpu
+from .scheduler import default_scheduler
+from .singleflight import SingleFlight, data_key, url_key
+from .deadline import SharedDeadline, current, remaining, shared, with_deadline
+from .hedging import resolve_hedger
+from .metrics import resolve_metrics, stage, traced
+from .utils import parse_cookies
+from . import af_parser
 from urllib.parse import urlparse, urlencode
 
+def pixel_coords(center_x, center_y, per_width, per_height, image_dimensions):
+    img_width, img_height = image_dimensions
+
+    width = per_width * img_width
+    height = per_height * img_height
+
+    x = (center_x * img_width) - (width / 2)
+    y = (center_y * img_height) - (height / 2)
+
+    return {
+        'x': round(x),
+        'y': round(y),
+        'width': round(width),
+        'height': round(height)
+    }
+
 class BoundingBox:
+    __slots__ = ('center_per_x', 'center_per_y', 'per_width', 'per_height', '_image_dimensions')
+
     def __init__(self, box, image_dimensions):
         if not box:
             raise ValueError('Bounding box not set')
@@ -22,23 +49,11 @@ class BoundingBox:
         self.center_per_y = box[1]
         self.per_width = box[2]
         self.per_height = box[3]
-        self.pixel_coords = self._to_pixel_coords()
-
-    def _to_pixel_coords(self):
-        img_width, img_height = self._image_dimensions
-
-        width = self.per_width * img_width
-        height = self.per_height * img_height
-
-        x = (self.center_per_x * img_width) - (width / 2)
-        y = (self.center_per_y * img_height) - (height / 2)
 
-        return {
-            'x': round(x),
-            'y': round(y),
-            'width': round(width),
-            'height': round(height)
-        }
+    @property
+    def pixel_coords(self):
+        # computed on access, most callers only ever read the text
+        return pixel_coords(self.center_per_x, self.center_per_y, self.per_width, self.per_height, self._image_dimensions)
 
 class LensError(Exception):
     def __init__(self, message, code, headers, body):
@@ -48,21 +63,219 @@ class LensError(Exception):
         self.headers = headers
         self.body = body
 
+class LensTimeoutError(LensError):
+    # the scan's deadline passed, whatever was in flight has been cancelled
+    def __init__(self, message):
+        super().__init__(message, 'timeout', None, None)
+        self.name = 'LensTimeoutError'
+
 class Segment:
+    __slots__ = ('text', 'bounding_box')
+
     def __init__(self, text, bounding_box, image_dimensions):
         self.text = text
         self.bounding_box = BoundingBox(bounding_box, image_dimensions)
 
+class SegmentList(Sequence):
+    # read-only view over a result's columns, Segment objects are built per access
+    __slots__ = ('_result',)
+
+    def __init__(self, result):
+        self._result = result
+
+    def __len__(self):
+        return len(self._result._texts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        result = self._result
+        count = len(result._texts)
+        if index < 0:
+            index += count
+        # a negative index past the start would slice an empty box, raise like a list does
+        if not 0 <= index < count:
+            raise IndexError('segment index out of range')
+        return Segment(result._texts[index], result._boxes[index * 4:index * 4 + 4], result._dimensions)
+
+    def __iter__(self):
+        result = self._result
+        boxes = result._boxes
+        for i, text in enumerate(result._texts):
+            yield Segment(text, boxes[i * 4:i * 4 + 4], result._dimensions)
+
 class LensResult:
+    # texts in one list and all boxes as [cx, cy, w, h, ...] fractions in one
+    # float array, segments are a view built on demand
+    __slots__ = ('language', '_texts', '_boxes', '_dimensions', '_layout', 'spans')
+
     def __init__(self, language, segments):
+        texts = []
+        boxes = array('d')
+        dimensions = None
+        for segment in segments:
+            box = segment.bounding_box
+            texts.append(segment.text)
+            boxes.extend((box.center_per_x, box.center_per_y, box.per_width, box.per_height))
+            dimensions = box._image_dimensions
+
+        self._init(language, texts, boxes, dimensions)
+
+    def _init(self, language, texts, boxes, dimensions):
         self.language = language
-        self.segments = segments
+        self._texts = texts
+        self._boxes = boxes
+        self._dimensions = tuple(dimensions) if dimensions else None
+        self._layout = None
+        # per-stage timings, filled in when metrics are enabled
+        self.spans = []
+
+    def __copy__(self):
+        # shares the columns and layout, spans are the copy's own
+        result = LensResult.__new__(LensResult)
+        result._init(self.language, self._texts, self._boxes, self._dimensions)
+        result._layout = self._layout
+        return result
+
+    @classmethod
+    def from_columns(cls, language, texts, boxes, image_dimensions):
+        # boxes is a flat [cx, cy, w, h, ...] sequence or a list of 4-item boxes
+        texts = list(texts)
+        if not isinstance(boxes, array):
+            flat = array('d')
+            for box in boxes:
+                if isinstance(box, (int, float)):
+                    flat.append(box)
+                else:
+                    if not box:
+                        raise ValueError('Bounding box not set')
+                    flat.extend(box[:4])
+            boxes = flat
+        if len(boxes) != len(texts) * 4:
+            raise ValueError('Expected one bounding box per text segment')
+        if texts and (not image_dimensions or len(image_dimensions) != 2):
+            raise ValueError('Image dimensions not set')
+
+        result = cls.__new__(cls)
+        result._init(language, texts, boxes, image_dimensions)
+        return result
+
+    @property
+    def segments(self):
+        return SegmentList(self)
+
+    @property
+    def texts(self):
+        return self._texts
+
+    @property
+    def boxes(self):
+        # flat float64 buffer, numpy.frombuffer(result.boxes).reshape(-1, 4) wraps it without a copy
+        return memoryview(self._boxes)
+
+    @property
+    def image_dimensions(self):
+        return self._dimensions
+
+    def pixel_boxes(self):
+        # [x, y, width, height, ...] for every segment in one pass
+        coords = array('q')
+        if not self._texts:
+            return coords
+
+        img_width, img_height = self._dimensions
+        boxes = self._boxes
+        for i in range(0, len(boxes), 4):
+            width = boxes[i + 2] * img_width
+            height = boxes[i + 3] * img_height
+            coords.extend((
+                round(boxes[i] * img_width - width / 2),
+                round(boxes[i + 1] * img_height - height / 2),
+                round(width),
+                round(height)
+            ))
+        return coords
+
+    def _scale(self):
+        # layout works in pixels, or on a 1x1 page when dimensions are unknown (scan_by_url without them)
+        if self._dimensions and self._dimensions[0] and self._dimensions[1]:
+            return self._dimensions
+        return None
+
+    @property
+    def layout(self):
+        if self._layout is None:
+            scale_x, scale_y = self._scale() or (1, 1)
+            self._layout = Layout(to_rects(self._boxes, scale_x, scale_y))
+        return self._layout
+
+    def _subset(self, indices):
+        boxes = array('d')
+        for i in indices:
+            boxes.extend(self._boxes[i * 4:i * 4 + 4])
+        return LensResult.from_columns(self.language, [self._texts[i] for i in indices], boxes, self._dimensions)
+
+    def query_region(self, left, top, right, bottom, contained=False, relative=False):
+        # segments intersecting (or with contained=True, fully inside) the rectangle,
+        # in pixels, or in fractions of the image with relative=True
+        scale = self._scale()
+        if relative:
+            scale_x, scale_y = scale or (1, 1)
+            left, right = left * scale_x, right * scale_x
+            top, bottom = top * scale_y, bottom * scale_y
+        elif scale is None:
+            raise ValueError('Image dimensions not set, use relative coordinates')
+
+        return self._subset(self.layout.query(left, top, right, bottom, contained))
+
+    def reading_order(self):
+        return self._subset(self.layout.reading_order())
+
+    def lines(self):
+        return [self._subset(line) for line in self.layout.lines()]
+
+    def paragraphs(self):
+        return [self._subset(paragraph) for paragraph in self.layout.paragraphs()]
+
+    def columns(self):
+        return [self._subset(column) for column in self.layout.columns()]
+
+    def text(self, separator=None):
+        # lines in reading order, segments of a line joined by a space except for CJK text
+        if separator is None:
+            separator = '' if (self.language or '').split('-')[0] in ('ja', 'zh') else ' '
+        texts = self._texts
+        return '\n'.join(separator.join(texts[i] for i in line) for line in self.layout.lines())
+
+    def to_dict(self):
+        boxes = self._boxes
+        pixels = self.pixel_boxes()
+
+        return {
+            'language': self.language,
+            'segments': [
+                {
+                    'text': text,
+                    'bounding_box': {
+                        'center_per_x': boxes[i * 4],
+                        'center_per_y': boxes[i * 4 + 1],
+                        'per_width': boxes[i * 4 + 2],
+                        'per_height': boxes[i * 4 + 3],
+                        'pixel_coords': dict(zip(('x', 'y', 'width', 'height'), pixels[i * 4:i * 4 + 4]))
+                    }
+                }
+                for i, text in enumerate(self._texts)
+            ]
+        }
 
 class LensCore:
     def __init__(self, config=None, fetch=None):
         self._config = {}
-        self.cookies = {}
-        self._fetch = fetch or global_fetch
+        self.cookies = CookieJar()
+        # without an injected fetch function the instance owns a pooled transport
+        self._transport = Transport() if fetch is None else None
+        self._fetch = fetch or self._transport
 
         if config is None:
             config = {}
@@ -77,6 +290,7 @@ class LensCore:
             'majorChromeVersion': major_chrome_version,
             'sbisrc': f'Google Chrome {chrome_version} (Official) Windows',
             'userAgent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+            'clientData': 'CIW2yQEIorbJAQipncoBCIH+ygEIlaHLAQj1mM0BCIWgzQEI3ezNAQji+s0BCOmFzgEIponOAQj1ic4BCIeLzgEY1d3NARjS/s0BGNiGzgE=',
             'endpoint': LENS_ENDPOINT,
             'viewport': [1920, 1080],
             'headers': {},
@@ -87,7 +301,7 @@ class LensCore:
         # lowercase all headers
         for key in list(self._config['headers'].keys()):
             value = self._config['headers'][key]
-            if not value:
+            if not value and not isinstance(value, CookieJar):
                 del self._config['headers'][key]
                 continue
             if key.lower() != key:
@@ -95,18 +309,51 @@ class LensCore:
                 self._config['headers'][key.lower()] = value
 
         self._parse_cookies()
+        self._executor = resolve_executor(self._config.get('executor'), self._config.get('executorWorkers'))
+        # shared by every instance in the process unless a scheduler (or None) is configured
+        self._scheduler = self._config.get('scheduler', default_scheduler())
+        self._metrics = resolve_metrics(self._config.get('metrics'))
+        # identical scans in flight at the same time share one request
+        self._inflight = SingleFlight()
+        self._shared_deadlines = {}
+        # second request for responses slower than the recent percentile
+        self._hedger = resolve_hedger(self._config.get('hedge'))
+        # one consent exchange at a time, bumped when one succeeded
+        self._consent = SingleFlight()
+        self._consent_generation = 0
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
 
     def update_options(self, options):
         for key, value in options.items():
             self._config[key] = value
 
         self._parse_cookies()
+        self._executor = resolve_executor(self._config.get('executor'), self._config.get('executorWorkers'))
+        self._scheduler = self._config.get('scheduler', default_scheduler())
+        self._metrics = resolve_metrics(self._config.get('metrics'))
+
+    def _count(self, name, value=1, **labels):
+        if self._metrics is not None:
+            self._metrics.inc(name, value, **labels)
 
     async def fetch(self, options=None, original_dimensions=None, second_try=False):
         if options is None:
             options = {}
         if original_dimensions is None:
             original_dimensions = [0, 0]
+        # the request is sent again as it was after a consent redirect
+        original_options = options
+        # a consent saved while this request is in flight already covers it
+        consent_generation = self._consent_generation
 
         url = urlparse(options.get('endpoint', self._config['endpoint']))
         params = url.query
@@ -120,64 +367,171 @@ class LensCore:
 
         headers['cookie'] = self._generate_cookie_header(headers)
 
+        # the body is rebuilt for every attempt, a multipart body can't be sent twice
+        body_factory = options.get('bodyFactory')
+        options = {key: value for key, value in options.items() if key != 'bodyFactory'}
+
         url_query = f"{url.scheme}://{url.netloc}{url.path}?{params}"
-        response = await self._fetch(url_query, {
-            'headers': headers,
-            'redirect': 'manual',
-            **options,
-            #**self._config['fetchOptions']
-        })
+        with stage('network') as span:
+            response = await self._send(url_query, {
+                'headers': headers,
+                'redirect': 'manual',
+                **options,
+                #**self._config['fetchOptions']
+            }, body_factory, self._config.get('streamResponse', True))
+
+            text = response.get("text")
+            # bytes on the wire: Transport reports them (a streamed response only what
+            # was read before the callback turned up), other fetch functions only give text
+            received = response['received'] if 'received' in response else len(text.encode()) if text else 0
+            span.bytes = received
 
-        text = response.get("text")
+        self._count('lens_bytes_down_total', received)
 
-        cookie_string = "; ".join([str(value) for _, value in response.get("cookies").items()]).replace('Set-Cookie: ', '')
-        self._set_cookies(cookie_string) #response.headers.get('set-cookie'))
+        self._store_cookies(response)
 
         # in some of the EU countries, Google requires cookie consent
         if response.get("status") == 302:
+            self._count('lens_consent_redirects_total')
             if second_try:
                 raise LensError('Lens returned a 302 status code twice', response.get("status"), response.get("headers"), text)
 
-            consent_headers = self._generate_headers()
-            consent_headers['Content-Type'] = 'application/x-www-form-urlencoded'
-            consent_headers['Referer'] = 'https://consent.google.com/'
-            consent_headers['Origin'] = 'https://consent.google.com'
-
-            consent_headers['cookie'] = self._generate_cookie_header(consent_headers)
-
-            location = response.get("headers").get('Location')
+            location = next((value for key, value in response.get("headers").items() if key.lower() == 'location'), None)
 
             if not location:
                 raise ValueError('Location header not found')
 
-            redirect_link = urlparse(location)
-            params = redirect_link.query
-            params += '&x=6&set_eom=true&bl=boq_identityfrontenduiserver_20240129.02_p0&app=0'
-
-            await sleep(500)  # to not be suspicious
-            save_consent_request = await fetch('https://consent.google.com/save', {
-                'method': 'POST',
-                'headers': consent_headers,
-                'body': params,
-                'redirect': 'manual'
-            })
-
-            if save_consent_request.status == 303:
-                # consent was saved, save new cookies and retry the request
-                cookie_string = "; ".join([str(value) for _, value in save_consent_request.cookies.items()]).replace('Set-Cookie: ', '')
-                self._set_cookies(cookie_string)
-                await sleep(500)
-                return await self.fetch({}, original_dimensions, True)
+            if consent_generation == self._consent_generation:
+                # concurrent 302s wait for one exchange instead of each doing their own
+                await self._consent.do('consent', lambda: self._save_consent(location))
+            return await self.fetch(original_options, original_dimensions, True)
 
         if response.get("status") != 200:
+            self._count('lens_errors_total', status=response.get("status"))
             raise LensError('Lens returned a non-200 status code', response.get("status"), response.get("headers"), text)
 
         try:
-            af_data = LensCore.get_af_data(text)
-            return LensCore.parse_result(af_data, original_dimensions)
+            if 'value' in response:
+                # already found by the streaming scanner, only the lists are left to pull out
+                if response.get('error'):
+                    raise ValueError(response['error'])
+                if response['value'] is None:
+                    raise ValueError('Could not find matching AF_initDataCallback')
+                with stage('parse'):
+                    language, text_segments, text_regions = LensCore.extract_result(response['value'])
+            else:
+                with stage('parse', len(text)):
+                    language, text_segments, text_regions = await run_cpu(self._executor, parse_response, text)
+            return LensCore.build_result(language, text_segments, text_regions, original_dimensions)
         except Exception as e:
             raise LensError(f'Could not parse response: {str(e)}', response.get("status"), response.get("headers"), text)
 
+    def _store_cookies(self, response):
+        # one Set-Cookie string per cookie: joined into one, the parser would keep
+        # the first cookie and read the others as its attributes. injected fetch
+        # functions may hand over str(morsel), which starts with the header name
+        cookie_strings = [
+            value.OutputString() if hasattr(value, 'OutputString') else str(value).removeprefix('Set-Cookie: ')
+            for value in (response.get("cookies") or {}).values()
+        ]
+        if cookie_strings:
+            self._count('lens_cookie_refreshes_total')
+        self._set_cookies(cookie_strings) #response.headers.get('set-cookie'))
+
+    async def _save_consent(self, location):
+        # consent is session state: the cookies it sets go into the jar (saved
+        # with it) and every later request of this session sends them
+        consent_headers = self._generate_headers()
+        consent_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        consent_headers['Referer'] = 'https://consent.google.com/'
+        consent_headers['Origin'] = 'https://consent.google.com'
+
+        consent_headers['cookie'] = self._generate_cookie_header(consent_headers)
+
+        redirect_link = urlparse(location)
+        params = redirect_link.query
+        params += '&x=6&set_eom=true&bl=boq_identityfrontenduiserver_20240129.02_p0&app=0'
+
+        with stage('consent'):
+            response = await self._fetch('https://consent.google.com/save', {
+                'method': 'POST',
+                'headers': consent_headers,
+                'body': params,
+                'redirect': 'manual'
+            })
+
+        if response.get("status") != 303:
+            raise LensError('Could not save cookie consent', response.get("status"), response.get("headers"), response.get("text"))
+
+        self._store_cookies(response)
+        self._consent_generation += 1
+        self._count('lens_consent_saves_total')
+
+    def _request(self, url, request_init, streaming):
+        # fetch functions with a stream(url, request_init, scanner) method (Transport)
+        # hand back the parsed callback instead of the whole page
+        stream = getattr(self._fetch, 'stream', None) if streaming else None
+        if stream is None:
+            return self._fetch(url, request_init)
+        return stream(url, request_init, af_parser.CallbackScanner())
+
+    async def _exchange(self, url, request_init, body_factory, streaming):
+        from aiohttp import ClientError
+
+        # every request and hedge sends a fresh body
+        if body_factory is not None:
+            with stage('multipart'):
+                request_init = {**request_init, 'body': body_factory()}
+
+        self._count('lens_requests_total')
+
+        scheduler = self._scheduler
+        if scheduler is None:
+            return await self._request(url, request_init, streaming)
+
+        async with scheduler.slot() as outcome:
+            try:
+                response = await self._request(url, request_init, streaming)
+            except (ClientError, OSError, asyncio.TimeoutError):
+                outcome['status'] = None
+                self._count('lens_errors_total', status='network')
+                raise
+            outcome['status'] = response.get('status')
+            return response
+
+    async def _send(self, url, request_init, body_factory=None, streaming=False):
+        from aiohttp import ClientError
+
+        scheduler = self._scheduler
+        hedger = self._hedger
+        attempt = 0
+
+        while True:
+            try:
+                if hedger is None:
+                    response = await self._exchange(url, request_init, body_factory, streaming)
+                else:
+                    # the hedge goes out on another pooled connection, the first one is busy
+                    response = await hedger.run(lambda _: self._exchange(url, request_init, body_factory, streaming), self._count)
+            except (ClientError, OSError, asyncio.TimeoutError):
+                if scheduler is None or not scheduler.should_retry(None, attempt):
+                    raise
+                response = None
+
+            if scheduler is None or response is not None and not scheduler.should_retry(response.get('status'), attempt):
+                return response
+
+            scheduler.retried += 1
+            delay = scheduler.backoff(attempt)
+            left = remaining()
+            if left is not None and delay >= left:
+                # the retry could not finish before the deadline anyway
+                raise LensTimeoutError('Deadline passed before the request could be retried')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @traced
+    @with_deadline
     async def scan_by_url(self, url, dimensions=None):
         if dimensions is None:
             dimensions = [0, 0]
@@ -190,18 +544,43 @@ class LensCore:
             'method': 'GET',
         }
 
-        return await self.fetch(options, dimensions)
+        return await self._coalesce(url_key(url, dimensions), lambda: self.fetch(options, dimensions))
 
-    async def scan_by_data(self, uint8, mime, original_dimensions):
+    async def _coalesce(self, key, factory):
+        if not self._config.get('coalesce', True):
+            return await factory()
+        if key in self._inflight:
+            self._count('lens_coalesced_total')
+            group = self._shared_deadlines[key]
+        else:
+            group = self._shared_deadlines[key] = SharedDeadline()
+
+        # callers can have different deadlines, each enforces its own
+        deadline = current()
+        group.join(deadline)
+        try:
+            result = await self._inflight.do(key, shared(factory, group))
+        finally:
+            group.leave(deadline)
+            if group.empty and self._shared_deadlines.get(key) is group:
+                del self._shared_deadlines[key]
+        # every caller gets its own object, traced sets spans on it
+        return copy.copy(result)
+
+    @traced
+    @with_deadline
+    async def scan_by_data(self, uint8, mime, original_dimensions, dimensions=None):
         if mime not in SUPPORTED_MIMES:
             raise ValueError('File type not supported')
         if not original_dimensions:
             raise ValueError('Original dimensions not set')
 
-        file_name = f'image.{MIME_TO_EXT[mime]}'
+        # callers that already probed the image pass its dimensions along
+        if dimensions is None:
+            from PIL import Image
 
-        image = Image.open(io.BytesIO(uint8))
-        dimensions = image.size
+            with Image.open(open_buffer(uint8)) as image:
+                dimensions = image.size
         if not dimensions:
             raise ValueError('Could not determine image dimensions')
 
@@ -210,20 +589,45 @@ class LensCore:
         if width > 1000 or height > 1000:
             raise ValueError('Image dimensions are larger than 1000x1000')
 
-        formdata = FormData()
+        return await self._coalesce(data_key(uint8, mime, original_dimensions), lambda: self._upload(uint8, mime, original_dimensions, width, height))
 
-        formdata.add_field('encoded_image', uint8, filename=file_name, content_type=mime)
-        formdata.add_field('original_width', str(width))
-        formdata.add_field('original_height', str(height))
-        formdata.add_field('processed_image_dimensions', f'{width},{height}')
+    async def _upload(self, uint8, mime, original_dimensions, width, height):
+        cache = self._config.get('cache')
+        cache_key = None
+        if cache is not None:
+            with stage('cache'):
+                cache_key = cache.key(uint8, self._config)
+                cached = await cache_call(cache, cache.get, cache_key)
+            if cached is not None:
+                return cache.load_result(cached, original_dimensions)
+
+        file_name = f'image.{MIME_TO_EXT[mime]}'
+
+        def build_formdata():
+            from aiohttp import FormData
+
+            formdata = FormData()
+
+            formdata.add_field('encoded_image', uint8, filename=file_name, content_type=mime)
+            formdata.add_field('original_width', str(width))
+            formdata.add_field('original_height', str(height))
+            formdata.add_field('processed_image_dimensions', f'{width},{height}')
+
+            return formdata
 
         options = {
             'endpoint': LENS_ENDPOINT,
             'method': 'POST',
-            'body': formdata,
+            'bodyFactory': build_formdata,
         }
 
-        return await self.fetch(options, original_dimensions)
+        self._count('lens_bytes_up_total', len(uint8))
+        result = await self.fetch(options, original_dimensions)
+
+        if cache is not None:
+            await cache_call(cache, cache.set, cache_key, cache.dump_result(result))
+
+        return result
 
     def _generate_headers(self):
         return {
@@ -249,23 +653,17 @@ class LensCore:
             'Sec-Fetch-User': '?1',
             'Upgrade-Insecure-Requests': '1',
             'User-Agent': self._config['userAgent'],
-            'X-Client-Data': 'CIW2yQEIorbJAQipncoBCIH+ygEIlaHLAQj1mM0BCIWgzQEI3ezNAQji+s0BCOmFzgEIponOAQj1ic4BCIeLzgEY1d3NARjS/s0BGNiGzgE='
+            'X-Client-Data': self._config['clientData']
         }
 
     def _generate_cookie_header(self, header):
-        if self.cookies:
-            self.cookies = {name: cookie for name, cookie in self.cookies.items() if datetime.strptime(cookie['expires'].strip(), '%a, %d-%b-%Y %H:%M:%S GMT') > datetime.now()}#cookie['expires'] > time.time()}
-            header['cookie'] = '; '.join([f'{name}={cookie["value"]}' for name, cookie in self.cookies.items()])
-            return header['cookie']
-        return str()
+        cookie = self.cookies.header()
+        if cookie:
+            header['cookie'] = cookie
+        return cookie
 
     def _set_cookies(self, combined_cookie_header):
-        split_cookie_headers = split_cookies_string(combined_cookie_header)
-        cookies = cookie_parse(split_cookie_headers)
-
-        if cookies:
-            for cookie in cookies:
-                self.cookies[cookie['name']] = cookie
+        self.cookies.set_from_header(combined_cookie_header)
 
     def _parse_cookies(self):
         if 'cookie' in self._config.get('headers', {}):
@@ -278,24 +676,28 @@ class LensCore:
                         'value': cookies[cookie],
                         'expires': float('inf')
                     }
-            else:
+            elif isinstance(self._config['headers']['cookie'], CookieJar):
+                # a jar passed in is shared, not copied
                 self.cookies = self._config['headers']['cookie']
+            else:
+                self.cookies = CookieJar(self._config['headers']['cookie'])
 
     @staticmethod
     def get_af_data(text):
-        callbacks = re.findall(r'AF_initDataCallback\((\{.*?\})\)', text, re.DOTALL)
-        lens_callback = next((c for c in callbacks if 'DetectedObject' in c), None)
+        return af_parser.get_af_data(text)
 
-        if not lens_callback:
-            print(callbacks)
-            raise ValueError('Could not find matching AF_initDataCallback')
+    @staticmethod
+    def parse_result(af_data, image_dimensions):
+        language, text_segments, text_regions = LensCore.extract_result(af_data)
+        return LensCore.build_result(language, text_segments, text_regions, image_dimensions)
 
-        capitalize_string = re.sub(r"(false|true)", lambda m: m.group(1).capitalize(), lens_callback)
-        matched = replace_keys(capitalize_string.replace("null", "None"))
-        return eval(matched)
+    @staticmethod
+    def build_result(language, text_segments, text_regions, image_dimensions):
+        return LensResult.from_columns(language, text_segments, text_regions[:len(text_segments)], image_dimensions)
 
     @staticmethod
-    def parse_result(af_data, image_dimensions):
+    def extract_result(af_data):
+        # plain lists only, so the result can cross process boundaries
         data = af_data['data']
         full_text_part = data[3]
         text_segments = []
@@ -327,7 +729,15 @@ class LensCore:
                     text_segments.append(text)
                     text_regions.append(region)
 
-        segments = [Segment(text_segments[i], text_regions[i], image_dimensions) for i in range(len(text_segments))]
+        return full_text_part[3], text_segments, text_regions
+
+async def cache_call(cache, method, *args):
+    # the sqlite tier reads, commits and fsyncs on the calling thread, which
+    # would stall every other scan on the event loop. memory-only caches stay inline
+    if getattr(cache, 'path', None) is None:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
 
-        return LensResult(full_text_part[3], segments)
+def parse_response(text):
+    return LensCore.extract_result(LensCore.get_af_data(text))
 
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import base64
+import socket
+import asyncio
+import secrets
+import tempfile
+import contextlib
+from .index import Lens
+from .cookie_jar import CookieJar
+from .phash import NearDuplicateIndex
+from .daemon_client import parse_address, is_running, token_path
+
+class LensDaemon:
+    # keeps one warm Lens (connection pool, cookie jar, caches) and answers
+    # json-lines requests on a unix socket or localhost tcp:
+    #   {"op": "scan", "source": "/abs/path.png" | "https://...", "data": "<base64>", "timeout": seconds}
+    #   {"op": "ping"}, {"op": "stats"}, {"op": "shutdown"}
+    # every request carries "token", the session token from token_path(address).
+    # any local process can reach a tcp port, and scan reads any file the user can
+    def __init__(self, address=None, cookies_path=None, config=None, near_duplicates=False, _fetch=None):
+        self.address = parse_address(address)
+        self.cookies_path = cookies_path
+        self.scans = 0
+        self.errors = 0
+
+        cookies = CookieJar.from_file(cookies_path) if cookies_path else CookieJar()
+        config = {'headers': {'cookie': cookies}, 'metrics': True, **(config or {})}
+        # opt-in: a capture of the same content can reuse the last result, at
+        # the price of a thumbnail comparison per scan (see phash)
+        if near_duplicates:
+            config.setdefault('nearDuplicates', NearDuplicateIndex())
+        self.lens = Lens(config, _fetch)
+
+        self._server = None
+        self._stopped = None
+        self.token = None
+
+    async def start(self):
+        self._stopped = asyncio.Event()
+
+        if isinstance(self.address, tuple):
+            host, port = self.address
+            self._server = await asyncio.start_server(self._handle, host, port)
+            self._write_token()
+            return
+
+        if os.path.exists(self.address):
+            # a socket left behind by a daemon that didn't shut down cleanly
+            if is_running(self.address):
+                raise RuntimeError(f'A daemon is already listening on {self.address}')
+            os.unlink(self.address)
+
+        # created user-only, a chmod after bind would leave it open in between
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.address)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+
+        self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+        self._write_token()
+
+    def _write_token(self):
+        # mkstemp creates the file user-only, the rename never follows a planted link
+        self.token = secrets.token_urlsafe(32)
+        path = token_path(self.address)
+        fd, temp_path = tempfile.mkstemp(prefix='.chrome-lens-ocr-', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w', encoding='ascii') as f:
+                f.write(self.token)
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+
+    def _remove_token(self):
+        # only our own, another daemon may have taken over the address since
+        path = token_path(self.address)
+        with contextlib.suppress(OSError):
+            with open(path, 'r', encoding='ascii') as f:
+                ours = f.read().strip() == self.token
+            if ours:
+                os.unlink(path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.unlink(self.address)
+            self._remove_token()
+
+        self._save_cookies()
+        await self.lens.close()
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def _save_cookies(self):
+        if self.cookies_path:
+            self.lens.cookies.save(self.cookies_path)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                response = await self._dispatch(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                await writer.drain()
+
+                if response.get('op') == 'shutdown':
+                    # answer first, then stop accepting
+                    asyncio.get_running_loop().call_soon(self._stopped.set)
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError as error:
+            return {'ok': False, 'error': f'Invalid request: {error}'}
+        if not isinstance(message, dict):
+            return {'ok': False, 'error': 'Invalid request: expected an object'}
+
+        token = message.get('token')
+        if not isinstance(token, str) or not secrets.compare_digest(token, self.token):
+            return {'ok': False, 'error': 'Invalid token'}
+
+        op = message.get('op')
+        if op == 'ping':
+            return {'ok': True, 'op': 'ping', 'pid': os.getpid()}
+        if op == 'stats':
+            near_duplicates = self.lens._config.get('nearDuplicates')
+            return {'ok': True, 'op': 'stats', 'scans': self.scans, 'errors': self.errors, 'nearDuplicates': near_duplicates.stats if near_duplicates else None, 'coalesced': self.lens._inflight.stats, 'hedges': self.lens._hedger.stats if self.lens._hedger else None}
+        if op == 'shutdown':
+            return {'ok': True, 'op': 'shutdown'}
+        if op != 'scan':
+            return {'ok': False, 'error': f'Unknown op {op!r}'}
+
+        try:
+            timeout = message.get('timeout')
+            if 'data' in message:
+                result = await self.lens.scan_by_buffer(base64.b64decode(message['data']), timeout=timeout)
+            else:
+                result = await self.lens.scan(message['source'], timeout=timeout)
+        except Exception as error:
+            # one bad job must not take the daemon down
+            self.errors += 1
+            return {'ok': False, 'op': 'scan', 'error': str(error), 'code': getattr(error, 'code', None)}
+
+        self.scans += 1
+        # written only when a response changed them
+        self._save_cookies()
+        return {'ok': True, 'op': 'scan', 'text': result.text(), 'result': result.to_dict()}
+
+async def serve(address=None, cookies_path=None, config=None, near_duplicates=False):
+    daemon = LensDaemon(address, cookies_path, config, near_duplicates)
+    await daemon.start()
+    where = daemon.address if not isinstance(daemon.address, tuple) else '%s:%d' % daemon.address
+    print(f'Listening on {where}', file=sys.stderr, flush=True)
+    try:
+        await daemon._stopped.wait()
+    finally:
+        await daemon.stop()
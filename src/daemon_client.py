@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+from urllib.parse import urlparse
+
+# stdlib only, so forwarding a scan to a running daemon doesn't pay for
+# importing PIL, aiohttp and the rest of the package
+
+DEFAULT_PORT = 47615
+
+class DaemonError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+def default_address():
+    # a unix socket only the current user can open, localhost tcp where there are none
+    if sys.platform != 'win32' and hasattr(socket, 'AF_UNIX'):
+        return os.path.join(tempfile.gettempdir(), f'chrome-lens-ocr-{os.getuid()}.sock')
+    return ('127.0.0.1', DEFAULT_PORT)
+
+def parse_address(value):
+    # "host:port" or ":port" for tcp, anything else is a socket path
+    if value is None:
+        return default_address()
+    if isinstance(value, tuple):
+        return value
+    host, sep, port = value.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return value
+
+def token_path(address):
+    # the daemon writes a new token here every time it starts, readable by the
+    # user only: next to the socket, or in the temp directory (per user on windows) for tcp
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        return os.path.join(tempfile.gettempdir(), f'chrome-lens-ocr-{address[1]}.token')
+    return f'{address}.token'
+
+def read_token(address):
+    with open(token_path(address), 'r', encoding='ascii') as f:
+        return f.read().strip()
+
+def connect(address, timeout=None):
+    if isinstance(address, tuple):
+        return socket.create_connection(address, timeout)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def request(message, address=None, timeout=120):
+    # one json line out, one json line back. OSError (ConnectionRefusedError,
+    # FileNotFoundError) means no daemon is listening
+    address = parse_address(address)
+    message = {**message, 'token': read_token(address)}
+    with connect(address, timeout) as sock:
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+
+    if not line:
+        raise ConnectionError('Daemon closed the connection without answering')
+    return json.loads(line)
+
+def is_running(address=None):
+    try:
+        return request({'op': 'ping'}, address, timeout=2).get('ok', False)
+    except (OSError, ValueError):
+        return False
+
+def scan(source, address=None, timeout=120):
+    # the daemon has its own working directory, paths are sent absolute
+    if urlparse(source).scheme not in ['http', 'https']:
+        source = os.path.abspath(source)
+
+    response = request({'op': 'scan', 'source': source}, address, timeout)
+    if not response.get('ok'):
+        raise DaemonError(response.get('error', 'Unknown daemon error'), response.get('code'))
+    return response
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import functools
+import contextvars
+
+# one absolute deadline per scan, shared by every stage and nested scan_* call
+# it awaits. contextvars follow gather/ensure_future, so worker tasks see it too
+
+_current_deadline = contextvars.ContextVar('lens_deadline', default=None)
+
+class SharedDeadline:
+    # deadline of work shared by several callers (coalesced scans): the latest
+    # of the waiting callers' deadlines, None once one of them has none. the
+    # work is only pointless when no caller left could still use its result
+    def __init__(self):
+        self._waiting = []
+
+    def join(self, deadline):
+        self._waiting.append(deadline)
+
+    def leave(self, deadline):
+        self._waiting.remove(deadline)
+
+    @property
+    def empty(self):
+        return not self._waiting
+
+    def get(self):
+        if not self._waiting or None in self._waiting:
+            return None
+        return max(self._waiting)
+
+def current():
+    # absolute time.monotonic() deadline of the running call, None without one
+    deadline = _current_deadline.get()
+    if isinstance(deadline, SharedDeadline):
+        return deadline.get()
+    return deadline
+
+def remaining():
+    # seconds left before the current deadline, None without one
+    deadline = current()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def with_deadline(method):
+    # adds timeout=seconds to a scan_* method, the instance's 'timeout' config is
+    # the default for outermost calls. a nested timeout can only shorten the
+    # deadline. when it passes, everything in flight is cancelled (uploads
+    # included) and LensTimeoutError is raised
+    @functools.wraps(method)
+    async def wrapper(self, *args, timeout=None, **kwargs):
+        current_deadline = current()
+        if timeout is None and current_deadline is None:
+            timeout = self._config.get('timeout')
+        if timeout is None:
+            return await method(self, *args, **kwargs)
+
+        deadline = time.monotonic() + timeout
+        if current_deadline is not None and current_deadline <= deadline:
+            return await method(self, *args, **kwargs)
+
+        token = _current_deadline.set(deadline)
+        try:
+            # the task copies the context, so it runs with the new deadline
+            task = asyncio.ensure_future(method(self, *args, **kwargs))
+        finally:
+            _current_deadline.reset(token)
+
+        expired = False
+
+        def expire():
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        # cancelling the caller cancels the task too
+        timer = asyncio.get_running_loop().call_later(timeout, expire)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not expired:
+                raise
+            from .core import LensTimeoutError
+
+            raise LensTimeoutError(f'{method.__name__} did not finish within {timeout} seconds') from None
+        finally:
+            timer.cancel()
+
+    return wrapper
+
+def shared(factory, deadline):
+    # runs factory() under a SharedDeadline: each caller's own deadline cancels
+    # its wait, retries in the shared call are skipped by the latest one
+    async def run():
+        _current_deadline.set(deadline)
+        return await factory()
+    return run
@@ -0,0 +1,49 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+_shared_executors = {}
+
+def create_executor(kind='thread', max_workers=None):
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers, thread_name_prefix='lens')
+    if kind == 'process':
+        # pulls in multiprocessing, only when a process pool is asked for
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(max_workers)
+    raise ValueError(f"Unknown executor kind '{kind}', expected 'thread' or 'process'")
+
+def shared_executor(kind='thread', max_workers=None):
+    # one pool per kind and size for the whole process, reused by every Lens instance
+    key = (kind, max_workers)
+    if key not in _shared_executors:
+        _shared_executors[key] = create_executor(kind, max_workers)
+    return _shared_executors[key]
+
+def resolve_executor(executor, max_workers=None):
+    if executor is None or isinstance(executor, Executor):
+        return executor
+    if isinstance(executor, str):
+        return shared_executor(executor, max_workers)
+    raise TypeError(f'executor must be None, "thread", "process" or an Executor, got {type(executor)}')
+
+def shutdown_shared_executors(wait=True):
+    for executor in _shared_executors.values():
+        executor.shutdown(wait=wait)
+    _shared_executors.clear()
+
+def shares_memory(executor):
+    # work run inline or on a thread pool can be handed objects, process pools get pickled copies
+    return executor is None or isinstance(executor, ThreadPoolExecutor)
+
+async def run_cpu(executor, fn, *args):
+    # without an executor the stage runs inline on the event loop, like before
+    if executor is None:
+        return fn(*args)
+    if any(isinstance(arg, memoryview) for arg in args):
+        from concurrent.futures import ProcessPoolExecutor
+
+        if isinstance(executor, ProcessPoolExecutor):
+            # memoryviews (mapped files) can't be pickled, worker processes get a copy
+            args = [bytes(arg) if isinstance(arg, memoryview) else arg for arg in args]
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
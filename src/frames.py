@@ -0,0 +1,100 @@
+import os
+import re
+from .preprocess import MAX_DIMENSION, open_buffer, flatten, downscale, encode_jpeg
+
+# frame sequences (animated gif/webp, multi-page tiff, directories of video
+# frames) mostly repeat themselves, only frames that differ from the last
+# scanned one are uploaded
+
+FRAME_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+def natural_key(name):
+    # frame_2.png before frame_10.png
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def list_frames(directory):
+    names = [name for name in os.listdir(directory) if name.lower().endswith(FRAME_EXTENSIONS)]
+    return [os.path.join(directory, name) for name in sorted(names, key=natural_key)]
+
+def thumbnail(image, size):
+    # small grayscale copy of the frame, cheap to compare
+    from PIL import Image
+
+    width, height = image.size
+    scale = min(size / max(width, height), 1)
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # jpeg decodes straight at a fraction of the size, other formats ignore this
+    if image.format == 'JPEG':
+        image.draft('RGB', target)
+    return flatten(image).convert('L').resize(target, Image.BOX, reducing_gap=2.0)
+
+def changed(reference, current, threshold, cell=8):
+    # mean difference (0-255) per cell x cell block, above threshold anywhere.
+    # differencing before averaging keeps a replaced word visible, averaging
+    # first would blur both versions into the same grey. compression noise
+    # stays a few levels below the default threshold
+    from PIL import Image, ImageChops
+
+    if reference is None or reference.size != current.size:
+        return True
+
+    difference = ImageChops.difference(reference, current)
+    width, height = difference.size
+    cells = difference.resize((max(1, width // cell), max(1, height // cell)), Image.BOX)
+    return cells.getextrema()[1] > threshold
+
+class ChangeDetector:
+    # compares every frame against the last key frame rather than the previous
+    # frame, so a slow fade still adds up to a change
+    def __init__(self, size=640, threshold=6):
+        self.size = size
+        self.threshold = threshold
+        self._reference = None
+
+    def is_key(self, image):
+        current = thumbnail(image, self.size)
+        if not changed(self._reference, current, self.threshold):
+            return False
+        self._reference = current
+        return True
+
+def find_key_frames(buffer, detector):
+    # indices of the frames that start new content, and the frame count
+    from PIL import Image, ImageSequence
+
+    keys = []
+    count = 0
+    with Image.open(open_buffer(buffer)) as image:
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            if detector.is_key(frame):
+                keys.append(index)
+            count += 1
+    return keys, count
+
+def find_key_files(paths, detector):
+    from PIL import Image
+
+    keys = []
+    for index, path in enumerate(paths):
+        with Image.open(path) as image:
+            if detector.is_key(image):
+                keys.append(index)
+    return keys
+
+def encode_frames(buffer, indices, max_dimension=MAX_DIMENSION):
+    # (data, dimensions, original dimensions) for each wanted frame, decoded in a
+    # single pass. tiff pages can differ in size, so dimensions are per frame
+    from PIL import Image
+
+    frames = []
+    with Image.open(open_buffer(buffer)) as image:
+        for index in indices:
+            image.seek(index)
+            original_dimensions = list(image.size)
+            frame = downscale(image, max_dimension)
+            frames.append((encode_jpeg(frame), list(frame.size), original_dimensions))
+    return frames
+
+def timeline_ranges(keys, count):
+    # each key frame stands for itself and the unchanged frames after it
+    return [range(start, stop) for start, stop in zip(keys, keys[1:] + [count])]
@@ -0,0 +1,98 @@
+import time
+import asyncio
+from collections import deque
+
+# a few slow responses set the tail latency. a request still running after
+# most recent requests have finished is sent a second time, the first answer wins
+
+class Hedger:
+    def __init__(self, percentile=95, window=256, min_samples=20, min_delay=0.05, max_ratio=0.1):
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100')
+
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        # hedges sent at most for this share of requests, so a slow lens doesn't get twice the load
+        self.max_ratio = max_ratio
+
+        self.requests = 0
+        self.issued = 0
+        self.won = 0
+
+        self.latencies = deque(maxlen=window)
+
+    def delay(self):
+        # seconds to wait before hedging, None until enough latencies were seen
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))])
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+
+    async def run(self, attempt, count=None):
+        # attempt(0) is the request, attempt(1) the hedge, both return awaitables.
+        # count(name) is called for the lens_hedges_* metrics
+        self.requests += 1
+        delay = self.delay()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt(0))
+        tasks = {primary}
+
+        try:
+            if delay is None or self.issued >= self.max_ratio * self.requests:
+                result = await primary
+                self.record(time.monotonic() - started)
+                return result
+
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.issued += 1
+                if count is not None:
+                    count('lens_hedges_total')
+                tasks.add(asyncio.ensure_future(attempt(1)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        # the other one may still answer
+                        error = task.exception()
+                        continue
+
+                    # the request's own latency, or a lower bound of it when the hedge won,
+                    # so hedging doesn't pull the percentile down
+                    self.record(time.monotonic() - started)
+                    if task is not primary:
+                        self.won += 1
+                        if count is not None:
+                            count('lens_hedges_won_total')
+                    return task.result()
+
+            raise error
+        finally:
+            # the loser, or both when the caller was cancelled (deadline)
+            for task in tasks:
+                task.cancel()
+
+    @property
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'issued': self.issued,
+            'won': self.won,
+            'delay': self.delay()
+        }
+
+def resolve_hedger(hedge):
+    # config 'hedge': True for a per-instance Hedger, or a Hedger to share
+    if not hedge:
+        return None
+    if hedge is True:
+        return Hedger()
+    if isinstance(hedge, Hedger):
+        return hedge
+    raise TypeError(f'hedge must be True or a Hedger, got {type(hedge)}')
@@ -1,22 +1,29 @@
 import os
-import aiofiles
-from filetype import guess_mime
-from PIL import Image
-from .consts import global_fetch
-import io
+import errno
+import asyncio
+from urllib.parse import urlparse
+from .preprocess import MAX_DIMENSION, prepare_image, probe_dimensions, decode_image, encode_tile
+from .executor import run_cpu, shares_memory
+from .utils import map_file
+from .phash import fingerprint, first_match
+from .metrics import stage, traced
+from .deadline import with_deadline
+from .tiling import plan_tiles, merge_tile_segments, majority_language
+from .frames import ChangeDetector, list_frames, find_key_frames, find_key_files, encode_frames, timeline_ranges
+from .batch import BatchMixin
 
-from src.core import LensCore, LensResult, LensError, Segment, BoundingBox
+from .core import LensCore, LensResult, LensError, LensTimeoutError, Segment, BoundingBox
 
-class Lens(LensCore):
+class Lens(LensCore, BatchMixin):
     def __init__(self, config=None, _fetch=None):
         if not isinstance(config, dict):
             print(f"Lens constructor expects a dictionary, got {type(config)}")
             config = {}
 
-        fetch_fn = _fetch or global_fetch
-
-        super().__init__(config, fetch_fn)
+        super().__init__(config, _fetch)
 
+    @traced
+    @with_deadline
     async def scan_by_file(self, path):
         if not isinstance(path, str):
             raise TypeError(f"scan_by_file expects a string, got {type(path)}")
@@ -31,28 +38,145 @@ class Lens(LensCore):
             elif error.errno == errno.EISDIR:
                 raise IsADirectoryError(f"Expected file, Found directory: {path}")
 
-        async with aiofiles.open(path, mode='rb') as file:
-            buffer = await file.read()
+        return await self.scan_by_buffer(await self._read_file(path))
+
+    async def _read_file(self, path):
+        with stage('read') as span:
+            # mapped instead of read, the upload is sent straight from the page cache
+            buffer = map_file(path)
+            if buffer is None:
+                import aiofiles
 
-        return await self.scan_by_buffer(buffer)
+                async with aiofiles.open(path, mode='rb') as file:
+                    buffer = await file.read()
+            span.bytes = len(buffer)
 
+        return buffer
+
+    @traced
+    @with_deadline
     async def scan_by_buffer(self, buffer):
-        mime_type = guess_mime(buffer)
+        near_duplicates = self._config.get('nearDuplicates')
+        if near_duplicates is not None:
+            with stage('phash', len(buffer)):
+                value, dimensions, pixels = await run_cpu(self._executor, fingerprint, buffer, near_duplicates.hash_size, near_duplicates.thumbnail_size)
+                candidates = near_duplicates.candidates(value, dimensions)
+                match = None
+                if candidates:
+                    thumbnails = [stored for _, stored in candidates]
+                    match = await run_cpu(self._executor, first_match, thumbnails, pixels, near_duplicates.pixel_threshold)
+                cached = near_duplicates.confirm(candidates, match)
+            if cached is not None:
+                self._count('lens_near_duplicate_hits_total')
+                return near_duplicates.load_result(cached, list(dimensions))
+
+        with stage('prepare', len(buffer)) as span:
+            prepared = await run_cpu(self._executor, prepare_image, buffer, MAX_DIMENSION, self._config.get('optimizeUpload'))
+            if prepared.bytes_saved:
+                span.info = {'bytes_saved': prepared.bytes_saved}
+
+        self._count('lens_upload_bytes_saved_total', prepared.bytes_saved)
+        result = await self.scan_by_data(prepared.data, prepared.mime, prepared.original_dimensions, prepared.dimensions)
+
+        if near_duplicates is not None:
+            near_duplicates.set(value, dimensions, pixels, near_duplicates.dump_result(result))
+
+        return result
+
+    @traced
+    @with_deadline
+    async def scan_tiled(self, buffer, tile_size=1000, overlap=100, concurrency=4):
+        width, height = probe_dimensions(buffer)
+
+        if width <= tile_size and height <= tile_size:
+            return await self.scan_by_buffer(buffer)
+
+        tiles = plan_tiles(width, height, tile_size, overlap)
+        source = buffer
+        if shares_memory(self._executor):
+            with stage('prepare', len(buffer)):
+                source = await run_cpu(self._executor, decode_image, buffer)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def scan_tile(tile):
+            left, top, right, bottom = tile
+            tile_width, tile_height = right - left, bottom - top
+
+            # encoded when its turn comes, at most concurrency tiles are held at once
+            async with semaphore:
+                with stage('prepare'):
+                    data = await run_cpu(self._executor, encode_tile, source, tile)
+                result = await self.scan_by_data(data, 'image/jpeg', [tile_width, tile_height], [tile_width, tile_height])
+
+            segments = []
+            boxes = result.boxes
+            for i, text in enumerate(result.texts):
+                center_x = left + boxes[i * 4] * tile_width
+                center_y = top + boxes[i * 4 + 1] * tile_height
+                half_width = boxes[i * 4 + 2] * tile_width / 2
+                half_height = boxes[i * 4 + 3] * tile_height / 2
+                segments.append((text, [center_x - half_width, center_y - half_height, center_x + half_width, center_y + half_height], tile))
+
+            return result, segments
+
+        tiles = await asyncio.gather(*(scan_tile(tile) for tile in tiles))
+
+        merged = merge_tile_segments([segment for _, segments in tiles for segment in segments])
+        boxes = []
+        for _, (x0, y0, x1, y1), _ in merged:
+            boxes.extend(((x0 + x1) / 2 / width, (y0 + y1) / 2 / height, (x1 - x0) / width, (y1 - y0) / height))
+
+        return LensResult.from_columns(majority_language(result for result, _ in tiles), [text for text, _, _ in merged], boxes, [width, height])
+
+    @with_deadline
+    async def scan_frames(self, source, concurrency=4, thumbnail_size=640, change_threshold=6):
+        # source: a multi-frame image (buffer or path) or a directory of frames.
+        # returns [(range of frame indices, LensResult)], one entry per run of unchanged frames
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        detector = ChangeDetector(thumbnail_size, change_threshold)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        if isinstance(source, os.PathLike):
+            source = os.fspath(source)
+
+        if isinstance(source, str) and os.path.isdir(source):
+            paths = list_frames(source)
+            if not paths:
+                return []
+
+            keys = await run_cpu(self._executor, find_key_files, paths, detector)
+
+            async def scan_key(index):
+                async with semaphore:
+                    return await self.scan_by_file(paths[index])
+
+            results = await asyncio.gather(*(scan_key(index) for index in keys))
+            return list(zip(timeline_ranges(keys, len(paths)), results))
+
+        buffer = source if isinstance(source, (bytes, bytearray, memoryview)) else await self._read_file(source)
+
+        keys, count = await run_cpu(self._executor, find_key_frames, buffer, detector)
+        frames = await run_cpu(self._executor, encode_frames, buffer, keys, MAX_DIMENSION)
+
+        async def scan_frame(data, dimensions, original_dimensions):
+            async with semaphore:
+                return await self.scan_by_data(data, 'image/jpeg', original_dimensions, dimensions)
 
-        if not mime_type:
-            raise ValueError('File type not supported')
+        results = await asyncio.gather(*(scan_frame(*frame) for frame in frames))
+        return list(zip(timeline_ranges(keys, count), results))
 
-        image = Image.open(io.BytesIO(buffer))
-        width, height = image.size
+    @with_deadline
+    async def scan(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return await self.scan_by_buffer(source)
 
-        # Google Lens does not accept images larger than 1000x1000
-        if width > 1000 or height > 1000:
-            image.thumbnail((1000, 1000))
-            output = io.BytesIO()
-            image.save(output, format='JPEG', quality=90, progressive=True)
-            width, height = image.size
-            buffer = output.getvalue()
-            mime_type = 'image/jpeg'
+        if isinstance(source, os.PathLike):
+            source = os.fspath(source)
 
-        return await self.scan_by_data(buffer, mime_type, [width, height])
+        # remove Windows drive prefix because false positive
+        if isinstance(source, str) and urlparse(source).scheme in ['http', 'https']:
+            return await self.scan_by_url(source)
 
+        return await self.scan_by_file(source)
@@ -0,0 +1,234 @@
+import math
+from array import array
+
+# layout over a result's boxes, all coordinates are (x0, y0, x1, y1) in
+# pixels, or in fractions scaled to a 1x1 image when dimensions are unknown
+
+def to_rects(boxes, scale_x, scale_y):
+    # flat [cx, cy, w, h, ...] fractions -> flat [x0, y0, x1, y1, ...]
+    rects = array('d', bytes(len(boxes) * 8))
+    for i in range(0, len(boxes), 4):
+        half_width = boxes[i + 2] * scale_x / 2
+        half_height = boxes[i + 3] * scale_y / 2
+        center_x = boxes[i] * scale_x
+        center_y = boxes[i + 1] * scale_y
+        rects[i] = center_x - half_width
+        rects[i + 1] = center_y - half_height
+        rects[i + 2] = center_x + half_width
+        rects[i + 3] = center_y + half_height
+    return rects
+
+def median(values):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+class GridIndex:
+    # uniform grid over the segments' extent, about one segment per cell, so a
+    # region query only looks at the cells it covers
+    def __init__(self, rects):
+        self.rects = rects
+        self.cells = {}
+        count = len(rects) // 4
+        if not count:
+            self.origin = self.extent = (0, 0)
+            self.cell_size = (1, 1)
+            return
+
+        left = min(rects[0::4])
+        top = min(rects[1::4])
+        right = max(rects[2::4])
+        bottom = max(rects[3::4])
+        side = max(1, math.isqrt(count))
+        self.origin = (left, top)
+        self.cell_size = ((right - left) / side or 1, (bottom - top) / side or 1)
+        self.extent = (right, bottom)
+
+        for i in range(count):
+            for cell in self._cells(rects[i * 4], rects[i * 4 + 1], rects[i * 4 + 2], rects[i * 4 + 3]):
+                self.cells.setdefault(cell, []).append(i)
+
+    def _cells(self, x0, y0, x1, y1):
+        left, top = self.origin
+        cell_width, cell_height = self.cell_size
+        for column in range(math.floor((x0 - left) / cell_width), math.floor((x1 - left) / cell_width) + 1):
+            for row in range(math.floor((y0 - top) / cell_height), math.floor((y1 - top) / cell_height) + 1):
+                yield column, row
+
+    def query(self, x0, y0, x1, y1, contained=False):
+        # indices of the segments intersecting (or fully inside) the rectangle, in index order
+        rects = self.rects
+        found = set()
+        if not self.cells:
+            return []
+
+        # clamp to the populated area so a page-sized query doesn't walk empty cells
+        left, top = self.origin
+        right, bottom = self.extent
+        qx0, qy0 = max(x0, left), max(y0, top)
+        qx1, qy1 = min(x1, right), min(y1, bottom)
+        if qx0 > qx1 or qy0 > qy1:
+            return []
+
+        for cell in self._cells(qx0, qy0, qx1, qy1):
+            for i in self.cells.get(cell, ()):
+                if i in found:
+                    continue
+                rx0, ry0, rx1, ry1 = rects[i * 4:i * 4 + 4]
+                if contained:
+                    hit = rx0 >= x0 and ry0 >= y0 and rx1 <= x1 and ry1 <= y1
+                else:
+                    hit = rx0 <= x1 and rx1 >= x0 and ry0 <= y1 and ry1 >= y0
+                if hit:
+                    found.add(i)
+
+        return sorted(found)
+
+def _gaps(rects, indices, axis, min_gap):
+    # sweep over the projection on one axis, returns (position, size) of every
+    # empty band wider than min_gap
+    ordered = sorted(indices, key=lambda i: rects[i * 4 + axis])
+    gaps = []
+    reach = rects[ordered[0] * 4 + axis + 2]
+    for position, i in enumerate(ordered[1:], 1):
+        start = rects[i * 4 + axis]
+        if start - reach > min_gap:
+            gaps.append((position, start - reach))
+        reach = max(reach, rects[i * 4 + axis + 2])
+    return ordered, gaps
+
+def _split(ordered, gaps):
+    parts = []
+    previous = 0
+    for position, _ in gaps:
+        parts.append(ordered[previous:position])
+        previous = position
+    parts.append(ordered[previous:])
+    return parts
+
+def xy_cut(rects, indices, min_gap_x, min_gap_y):
+    # recursive XY-cut: split at column gutters first, otherwise at the widest
+    # horizontal gaps. returns leaf blocks in reading order as (column, indices),
+    # column identifies the nearest column the block belongs to (None for full width)
+    blocks = []
+    stack = [(list(indices), None)]
+    next_column = 0
+
+    while stack:
+        indices, column = stack.pop()
+        if len(indices) < 2:
+            blocks.append((column, indices))
+            continue
+
+        # a single line has no columns, wide word gaps stay in the line
+        height = max(rects[i * 4 + 3] for i in indices) - min(rects[i * 4 + 1] for i in indices)
+        ordered, gaps = _gaps(rects, indices, 0, min_gap_x) if height > min_gap_y * 3 else (None, None)
+        if gaps:
+            parts = []
+            for part in _split(ordered, gaps):
+                parts.append((part, next_column))
+                next_column += 1
+            stack.extend(reversed(parts))
+            continue
+
+        ordered, gaps = _gaps(rects, indices, 1, min_gap_y)
+        if gaps:
+            # cut at the widest gap, and at once at every gap as wide (evenly spaced
+            # paragraphs or list items) so they don't take one level each
+            widest = max(size for _, size in gaps)
+            gaps = [gap for gap in gaps if gap[1] >= widest * 0.95]
+            stack.extend((part, column) for part in reversed(_split(ordered, gaps)))
+            continue
+
+        blocks.append((column, indices))
+
+    return blocks
+
+def group_lines(rects, indices):
+    # segments overlapping vertically by at least half the smaller height share a line
+    ordered = sorted(indices, key=lambda i: (rects[i * 4 + 1] + rects[i * 4 + 3]) / 2)
+    lines = []
+    line_top = line_bottom = None
+    for i in ordered:
+        y0, y1 = rects[i * 4 + 1], rects[i * 4 + 3]
+        if lines:
+            overlap = min(y1, line_bottom) - max(y0, line_top)
+            if overlap >= min(y1 - y0, line_bottom - line_top) / 2:
+                lines[-1].append(i)
+                line_top, line_bottom = min(line_top, y0), max(line_bottom, y1)
+                continue
+        lines.append([i])
+        line_top, line_bottom = y0, y1
+
+    for line in lines:
+        line.sort(key=lambda i: rects[i * 4])
+    return lines
+
+class Layout:
+    def __init__(self, rects):
+        self.rects = rects
+        self._index = None
+        self._blocks = None
+
+        heights = [rects[i + 3] - rects[i + 1] for i in range(0, len(rects), 4)]
+        self.line_height = median(heights)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = GridIndex(self.rects)
+        return self._index
+
+    @property
+    def blocks(self):
+        # leaf blocks of the XY-cut, each a list of lines of segment indices
+        if self._blocks is None:
+            count = len(self.rects) // 4
+            if not count:
+                self._blocks = []
+            else:
+                # a gutter is wider than a word gap, paragraphs are further apart than lines
+                cuts = xy_cut(self.rects, range(count), self.line_height * 1.0, self.line_height * 0.5)
+                self._blocks = [(column, group_lines(self.rects, indices)) for column, indices in cuts]
+        return self._blocks
+
+    def query(self, x0, y0, x1, y1, contained=False):
+        return self.index.query(x0, y0, x1, y1, contained)
+
+    def lines(self):
+        return [line for _, lines in self.blocks for line in lines]
+
+    def reading_order(self):
+        return [i for line in self.lines() for i in line]
+
+    def paragraphs(self):
+        # consecutive lines closer than one line height. the y-cut also splits
+        # at smaller gaps, so a paragraph carries on into the next block of the
+        # same column
+        paragraphs = []
+        rects = self.rects
+        previous_column = object()
+        previous_bottom = None
+        for column, lines in self.blocks:
+            if column != previous_column:
+                previous_bottom = None
+            for line in lines:
+                top = min(rects[i * 4 + 1] for i in line)
+                if previous_bottom is None or top - previous_bottom > self.line_height:
+                    paragraphs.append([])
+                paragraphs[-1].extend(line)
+                previous_bottom = max(rects[i * 4 + 3] for i in line)
+            previous_column = column
+        return paragraphs
+
+    def columns(self):
+        # consecutive blocks in reading order that sit in the same column
+        columns = []
+        previous = object()
+        for column, lines in self.blocks:
+            if column != previous:
+                columns.append([])
+            columns[-1].extend(i for line in lines for i in line)
+            previous = column
+        return columns
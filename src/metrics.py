@@ -0,0 +1,221 @@
+import time
+import functools
+import contextvars
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DESCRIPTIONS = {
+    'lens_scans_total': 'Scans started through a Lens scan_* method',
+    'lens_scan_errors_total': 'Scans that raised an exception',
+    'lens_scan_seconds': 'End-to-end scan duration',
+    'lens_stage_seconds': 'Duration of each pipeline stage',
+    'lens_stage_bytes_total': 'Bytes handled by each pipeline stage',
+    'lens_requests_total': 'HTTP requests sent to Lens',
+    'lens_errors_total': 'Non-200 responses and network errors by status',
+    'lens_bytes_up_total': 'Image bytes uploaded',
+    'lens_upload_bytes_saved_total': 'Upload bytes saved by the upload optimizer',
+    'lens_near_duplicate_hits_total': 'Scans answered from a near-duplicate earlier result',
+    'lens_coalesced_total': 'Scans that joined an identical scan already in flight',
+    'lens_hedges_total': 'Duplicate requests sent for slow responses',
+    'lens_hedges_won_total': 'Hedged requests answered by the duplicate first',
+    'lens_bytes_down_total': 'Response body bytes received',
+    'lens_cookie_refreshes_total': 'Responses that set cookies',
+    'lens_consent_redirects_total': 'Consent 302 redirects received',
+    'lens_consent_saves_total': 'Cookie consent exchanges completed'
+}
+
+_current_trace = contextvars.ContextVar('lens_trace', default=None)
+
+def _sort_key(item):
+    # label values mix ints (statuses) and strings
+    (name, labels), _ = item
+    return name, [(key, str(value)) for key, value in labels]
+
+class Span:
+    def __init__(self, trace, stage, nbytes=None):
+        self.trace = trace
+        self.stage = stage
+        self.bytes = nbytes
+        self.start = None
+        self.duration = None
+        # stage specific values, merged into to_dict()
+        self.info = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        self.trace.record(self)
+        return False
+
+    def to_dict(self):
+        return {'stage': self.stage, 'start': self.start - self.trace.start, 'duration': self.duration, 'bytes': self.bytes, **(self.info or {})}
+
+class _NoopSpan:
+    # returned when nobody is listening, so instrumented code pays one contextvar lookup
+    bytes = None
+    info = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_noop_span = _NoopSpan()
+
+class Trace:
+    def __init__(self, metrics, method):
+        self.metrics = metrics
+        self.method = method
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def span(self, stage, nbytes=None):
+        return Span(self, stage, nbytes)
+
+    def record(self, span):
+        self.spans.append(span)
+        self.metrics.observe('lens_stage_seconds', span.duration, stage=span.stage)
+        if span.bytes:
+            self.metrics.inc('lens_stage_bytes_total', span.bytes, stage=span.stage)
+
+    def to_dict(self):
+        return {'method': self.method, 'duration': self.duration, 'spans': [span.to_dict() for span in self.spans]}
+
+def stage(name, nbytes=None):
+    trace = _current_trace.get()
+    if trace is None:
+        return _noop_span
+    return trace.span(name, nbytes)
+
+def traced(method):
+    # opens a trace for the outermost scan_* call, nested scan_* calls add to it
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        metrics = self._metrics
+        if metrics is None or _current_trace.get() is not None:
+            return await method(self, *args, **kwargs)
+
+        trace = Trace(metrics, method.__name__)
+        token = _current_trace.set(trace)
+        try:
+            result = await method(self, *args, **kwargs)
+        except BaseException as error:
+            metrics.finish(trace, error)
+            raise
+        finally:
+            _current_trace.reset(token)
+
+        result.spans = [span.to_dict() for span in trace.spans]
+        metrics.finish(trace)
+        return result
+
+    return wrapper
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def finish(self, trace, error=None):
+        trace.duration = time.perf_counter() - trace.start
+        self.inc('lens_scans_total', method=trace.method)
+        self.observe('lens_scan_seconds', trace.duration, method=trace.method)
+        if error is not None:
+            self.inc('lens_scan_errors_total', method=trace.method, error=type(error).__name__)
+
+        if self.callbacks:
+            event = trace.to_dict()
+            event['error'] = None if error is None else str(error)
+            for callback in self.callbacks:
+                callback(event)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in DESCRIPTIONS:
+                    lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(self.counters.items(), key=_sort_key):
+            header(name, 'counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+
+        for (name, labels), (counts, total, count) in sorted(self.histograms.items(), key=_sort_key):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{self._labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{name}_count{self._labels(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in self.counters.items()],
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'buckets': dict(zip(self.buckets, counts)), 'sum': total, 'count': count}
+                for (name, labels), (counts, total, count) in self.histograms.items()
+            ]
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+_default_metrics = None
+
+def default_metrics():
+    global _default_metrics
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+    return _default_metrics
+
+def resolve_metrics(metrics):
+    if metrics is True:
+        return default_metrics()
+    return metrics or None
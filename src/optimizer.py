@@ -0,0 +1,119 @@
+import io
+from PIL import Image, ImageChops, ImageStat
+from .consts import SUPPORTED_MIMES
+
+# re-encodes the upload in whatever supported format is smallest, while the
+# decoded result stays close enough to the source for OCR
+
+PIL_FORMATS = {
+    'image/webp': 'WEBP',
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG'
+}
+
+DEFAULT_OPTIONS = {
+    # tried in this order, only formats Lens accepts (SUPPORTED_MIMES) are used.
+    # png goes first, on text it is usually smallest and needs no quality check
+    'formats': ['image/png', 'image/webp', 'image/jpeg'],
+    # lossy qualities, lowest first, the first one within maxError wins
+    'qualities': [60, 75, 90],
+    # try grayscale when dropping the color stays within maxError
+    'grayscale': True,
+    # rms pixel difference (0-255) allowed between the source and a lossy candidate
+    'maxError': 6.0,
+    # uploads smaller than this are sent as they are, and the search stops once below it
+    'minBytes': 16 * 1024
+}
+
+class Optimized:
+    def __init__(self, data, mime, original_bytes):
+        self.data = data
+        self.mime = mime
+        self.original_bytes = original_bytes
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+def resolve_options(options):
+    if not options:
+        return None
+    if options is True:
+        return DEFAULT_OPTIONS
+    return {**DEFAULT_OPTIONS, **options}
+
+def to_grayscale(image, max_error):
+    if image.mode == 'L':
+        return image
+    gray = image.convert('L')
+    difference = ImageStat.Stat(ImageChops.difference(image, gray.convert(image.mode)))
+    return gray if max(difference.rms) <= max_error else None
+
+def encode(image, mime, quality=None):
+    output = io.BytesIO()
+    if mime == 'image/png':
+        image.save(output, format='PNG', compress_level=6)
+    elif mime == 'image/jpeg':
+        image.save(output, format='JPEG', quality=quality, progressive=True, optimize=True)
+    else:
+        image.save(output, format=PIL_FORMATS[mime], quality=quality, method=1)
+    return output.getvalue()
+
+def rms_error(source, data):
+    with Image.open(io.BytesIO(data)) as decoded:
+        decoded = decoded.convert(source.mode)
+        difference = ImageStat.Stat(ImageChops.difference(source, decoded))
+    return max(difference.rms)
+
+def candidates(image, options):
+    gray = to_grayscale(image, options['maxError']) if options['grayscale'] else None
+    if gray is not None:
+        image = gray
+
+    for mime in options['formats']:
+        if mime not in SUPPORTED_MIMES or mime not in PIL_FORMATS:
+            continue
+        if mime == 'image/png':
+            if gray is not None:
+                yield image, mime, None, False
+                continue
+            # screenshots and text often fit a 256 color palette, exactly or close enough
+            few_colors = image.getcolors(256) is not None
+            if not few_colors:
+                yield image, mime, None, False
+            yield image.quantize(256), mime, None, not few_colors
+        else:
+            for quality in options['qualities']:
+                yield image, mime, quality, True
+
+def optimize(image, data, mime, options):
+    # image: decoded, flattened source pixels; data/mime: what would be uploaded otherwise
+    best = Optimized(data, mime, len(data))
+    if len(data) < options['minBytes']:
+        return best
+
+    # every candidate is compared with the pixels Lens would have seen
+    reference = image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+    skip = set()
+    for source, candidate_mime, quality, lossy in candidates(reference, options):
+        # small enough, more encoding costs more cpu than it saves on the wire
+        if len(best.data) < options['minBytes']:
+            break
+        if candidate_mime in skip:
+            continue
+
+        encoded = encode(source, candidate_mime, quality)
+        if len(encoded) >= len(best.data):
+            # higher qualities of this format only get bigger
+            if quality is not None:
+                skip.add(candidate_mime)
+            continue
+
+        if lossy and rms_error(reference, encoded) > options['maxError']:
+            continue
+
+        best = Optimized(encoded, candidate_mime, len(data))
+        if quality is not None:
+            skip.add(candidate_mime)
+
+    return best
@@ -0,0 +1,183 @@
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+from .preprocess import open_buffer
+from .frames import thumbnail, changed
+
+# near-duplicate reuse: the same content saved again (another encoder, other
+# metadata, recompression noise) gets a different file but the same pixels.
+# the dHash is only a candidate filter, text that differs in a few glyphs
+# ("1,234.00" / "7,284.00") hashes the same, so every candidate is confirmed
+# against the stored thumbnail cell by cell before its result is reused
+
+def _difference_bits(image, hash_size):
+    # dHash: one bit per horizontally adjacent pixel pair of a
+    # (hash_size + 1) x hash_size grayscale image
+    pixels = image.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(offset, offset + hash_size):
+            value = (value << 1) | (pixels[column] > pixels[column + 1])
+    return value
+
+def fingerprint(buffer, hash_size=16, thumbnail_size=640):
+    # dHash plus the grayscale thumbnail that confirms a match, from one decode.
+    # returns (hash, image size, (thumbnail size, thumbnail bytes))
+    from PIL import Image
+
+    with Image.open(open_buffer(buffer)) as image:
+        dimensions = tuple(image.size)
+        reference = thumbnail(image, thumbnail_size)
+
+    small = reference.resize((hash_size + 1, hash_size), Image.BOX)
+    return _difference_bits(small, hash_size), dimensions, (reference.size, reference.tobytes())
+
+def _same_pixels(stored, pixels, threshold):
+    from PIL import Image
+
+    (stored_size, stored_data), (size, data) = stored, pixels
+    if stored_size != size:
+        return False
+    reference = Image.frombytes('L', stored_size, zlib.decompress(stored_data))
+    return not changed(reference, Image.frombytes('L', size, data), threshold)
+
+def first_match(thumbnails, pixels, threshold):
+    # position of the first stored thumbnail pixels match, None when none does.
+    # the cpu part of a lookup, run in the executor and outside the index's lock
+    for position, stored in enumerate(thumbnails):
+        if _same_pixels(stored, pixels, threshold):
+            return position
+    return None
+
+class NearDuplicateIndex:
+    # LRU of scan results keyed by perceptual hash, looked up by Hamming distance.
+    # multi-index hashing: the hash is cut into threshold + 1 chunks, two hashes
+    # within threshold bits of each other share at least one chunk exactly, so a
+    # query only compares against entries found in the chunk tables.
+    # pixel_threshold is frames.changed's per-cell limit for the confirmation.
+    # hashes collide for different text, so an entry is keyed by its thumbnail too
+    def __init__(self, max_entries=256, threshold=4, hash_size=16, thumbnail_size=640, pixel_threshold=6):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        bits = hash_size * hash_size
+        if not 0 <= threshold < bits:
+            raise ValueError(f'threshold must be between 0 and {bits - 1}')
+
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.thumbnail_size = thumbnail_size
+        self.pixel_threshold = pixel_threshold
+
+        chunks = threshold + 1
+        widths = [bits // chunks + (1 if i < bits % chunks else 0) for i in range(chunks)]
+        self._chunks = []
+        shift = bits
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+
+        self.hits = 0
+        self.misses = 0
+        # hash candidates the pixel check turned down
+        self.rejected = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._tables = [{} for _ in self._chunks]
+        self._lock = threading.Lock()
+
+    def _keys(self, value, dimensions):
+        # only images of the same size are compared
+        return [(dimensions, (value >> shift) & mask) for shift, mask in self._chunks]
+
+    def candidates(self, value, dimensions):
+        # stored entries within threshold bits, closest first, as (entry, thumbnail)
+        with self._lock:
+            candidates = {}
+            for table, key in zip(self._tables, self._keys(value, dimensions)):
+                for entry in table.get(key, ()):
+                    distance = (entry[0] ^ value).bit_count()
+                    if distance <= self.threshold:
+                        candidates[entry] = distance
+
+            return [(entry, self._entries[entry][1]) for entry in sorted(candidates, key=candidates.get)]
+
+    def confirm(self, candidates, match):
+        # match is first_match's answer for the candidates' thumbnails. returns the
+        # matching entry's result, None without a match or when it has been evicted
+        # while the thumbnails were compared
+        with self._lock:
+            self.rejected += len(candidates) if match is None else match
+            entry = candidates[match][0] if match is not None else None
+            if entry not in self._entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(entry)
+            return self._entries[entry][0]
+
+    def get(self, value, dimensions, pixels):
+        # closest stored result within threshold bits whose thumbnail matches
+        # pixels (as returned by fingerprint), or None. compares in this thread
+        candidates = self.candidates(value, dimensions)
+        match = first_match([stored for _, stored in candidates], pixels, self.pixel_threshold)
+        return self.confirm(candidates, match)
+
+    def set(self, value, dimensions, pixels, result):
+        size, data = pixels
+        # text screenshots compress well, the thumbnails are most of the index's memory
+        stored = (size, zlib.compress(data, 1))
+        with self._lock:
+            entry = (value, dimensions, zlib.crc32(data))
+            if entry not in self._entries:
+                for table, key in zip(self._tables, self._keys(value, dimensions)):
+                    table.setdefault(key, set()).add(entry)
+
+            self._entries[entry] = (result, stored)
+            self._entries.move_to_end(entry)
+
+            while len(self._entries) > self.max_entries:
+                old_entry, _ = self._entries.popitem(last=False)
+                self._remove(old_entry)
+                self.evictions += 1
+
+    def _remove(self, entry):
+        value, dimensions, _ = entry
+        for table, key in zip(self._tables, self._keys(value, dimensions)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry)
+                if not bucket:
+                    del table[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+
+    @staticmethod
+    def dump_result(result):
+        # plain columns, a fresh LensResult is built for every hit
+        return result.language, list(result.texts), array('d', result.boxes)
+
+    @staticmethod
+    def load_result(data, image_dimensions):
+        from .core import LensResult
+
+        language, texts, boxes = data
+        return LensResult.from_columns(language, list(texts), array('d', boxes), image_dimensions)
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'rejected': self.rejected,
+            'evictions': self.evictions,
+            'size': len(self._entries)
+        }
@@ -0,0 +1,221 @@
+import time
+import base64
+import random
+import asyncio
+from collections import deque
+from .core import LensError, LensTimeoutError
+from .cookie_jar import CookieJar
+from .batch import BatchMixin
+from .index import Lens
+from .deadline import with_deadline
+from .hedging import resolve_hedger
+from .scheduler import Scheduler
+
+CHROME_VERSIONS = [
+    '124.0.6367.60',
+    '124.0.6367.91',
+    '123.0.6312.122',
+    '125.0.6422.60',
+    '122.0.6261.129',
+    '124.0.6367.118',
+    '123.0.6312.86',
+    '125.0.6422.112'
+]
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def generate_client_data(rng, variations=13, triggers=3):
+    # X-Client-Data is a base64 protobuf of the field trial ids chrome was put in:
+    # field 1 holds variation ids, field 3 trigger ids, each a varint
+    ids = rng.sample(range(3300000, 3380000), variations + triggers)
+    message = b''.join(b'\x08' + _varint(value) for value in sorted(ids[:variations]))
+    message += b''.join(b'\x18' + _varint(value) for value in sorted(ids[variations:]))
+    return base64.b64encode(message).decode()
+
+def generate_identity(index):
+    chrome_version = CHROME_VERSIONS[index % len(CHROME_VERSIONS)]
+    major_chrome_version = chrome_version.split('.')[0]
+    # seeded, so an identity keeps its client data (and the cookies that go with it) across runs
+    rng = random.Random(f'identity-{index}')
+
+    return {
+        'chromeVersion': chrome_version,
+        'userAgent': f'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{major_chrome_version}.0.0.0 Safari/537.36',
+        'clientData': generate_client_data(rng)
+    }
+
+class PoolMember:
+    def __init__(self, name, lens, latency_window=100):
+        self.name = name
+        self.lens = lens
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def healthy(self, now):
+        return self.cooldown_until <= now
+
+    def mean_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0
+
+    def latency_percentile(self, percentile):
+        if not self.latencies:
+            return 0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    @property
+    def stats(self):
+        return {
+            'name': self.name,
+            'chromeVersion': self.lens._config['chromeVersion'],
+            'requests': self.requests,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'healthy': self.healthy(time.monotonic()),
+            'mean_latency': self.mean_latency(),
+            'p50_latency': self.latency_percentile(50),
+            'p95_latency': self.latency_percentile(95)
+        }
+
+class LensPool(BatchMixin):
+    # spreads scans over several independent Lens identities, each with its
+    # own cookie jar, browser headers, connection pool and scheduler. pass
+    # 'scheduler' in config to share one rate limit between all of them
+    def __init__(self, size=4, config=None, identities=None, failure_threshold=3, cooldown=60, hedge=None, _fetch=None):
+        if config is None:
+            config = {}
+        if identities is None:
+            identities = [generate_identity(i) for i in range(size)]
+        if not identities:
+            raise ValueError('LensPool needs at least one identity')
+
+        # 'timeout' applies to pool calls as it does to Lens calls
+        self._config = config
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # slow scans are sent again through a different identity
+        self._hedger = resolve_hedger(hedge)
+        self.members = [
+            PoolMember(f'identity-{i}', Lens(self._identity_config(config, identity), _fetch))
+            for i, identity in enumerate(identities)
+        ]
+
+    @staticmethod
+    def _identity_config(config, identity):
+        headers = {**config.get('headers', {}), **identity.get('headers', {})}
+        # identities must never share a cookie jar, a shared one is copied
+        if isinstance(headers.get('cookie'), CookieJar):
+            headers['cookie'] = CookieJar(headers['cookie'])
+
+        identity_config = {**config, **identity, 'headers': headers}
+        # one identity being throttled must not slow the others down
+        if 'scheduler' not in identity_config:
+            identity_config['scheduler'] = Scheduler()
+        return identity_config
+
+    def _pick(self, exclude=()):
+        now = time.monotonic()
+        healthy = [member for member in self.members if member.healthy(now)]
+
+        # if every identity is cooling down, use the one that recovers first
+        if not healthy:
+            return min(self.members, key=lambda member: member.cooldown_until)
+
+        # a hedge goes to another identity when there is a healthy one
+        others = [member for member in healthy if member not in exclude]
+        return min(others or healthy, key=lambda member: (member.in_flight, member.mean_latency()))
+
+    def _record_failure(self, member):
+        member.errors += 1
+        member.consecutive_failures += 1
+        if member.consecutive_failures >= self.failure_threshold:
+            member.cooldown_until = time.monotonic() + self.cooldown
+            member.consecutive_failures = 0
+
+    async def _run(self, method, *args):
+        if self._hedger is None:
+            return await self._run_member(self._pick(), method, *args)
+
+        picked = []
+
+        def attempt(_):
+            member = self._pick(picked)
+            picked.append(member)
+            return self._run_member(member, method, *args)
+
+        return await self._hedger.run(attempt)
+
+    async def _run_member(self, member, method, *args):
+        from aiohttp import ClientError
+
+        member.in_flight += 1
+        member.requests += 1
+        started = time.monotonic()
+
+        try:
+            result = await getattr(member.lens, method)(*args)
+        except (LensError, ClientError, ConnectionError, asyncio.TimeoutError) as error:
+            # bad input is the caller's fault, only lens/network failures count against an
+            # identity. a LensTimeoutError is the caller's own deadline running out
+            if not isinstance(error, LensError) or (error.code is not None and not isinstance(error, LensTimeoutError)):
+                self._record_failure(member)
+            raise
+        finally:
+            member.in_flight -= 1
+
+        member.consecutive_failures = 0
+        member.latencies.append(time.monotonic() - started)
+        return result
+
+    @with_deadline
+    async def scan(self, source):
+        return await self._run('scan', source)
+
+    @with_deadline
+    async def scan_by_file(self, path):
+        return await self._run('scan_by_file', path)
+
+    @with_deadline
+    async def scan_by_buffer(self, buffer):
+        return await self._run('scan_by_buffer', buffer)
+
+    @with_deadline
+    async def scan_by_url(self, url, dimensions=None):
+        return await self._run('scan_by_url', url, dimensions)
+
+    @with_deadline
+    async def scan_by_data(self, uint8, mime, original_dimensions, dimensions=None):
+        return await self._run('scan_by_data', uint8, mime, original_dimensions, dimensions)
+
+    @property
+    def stats(self):
+        members = [member.stats for member in self.members]
+        requests = sum(member['requests'] for member in members)
+        errors = sum(member['errors'] for member in members)
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'healthy': sum(member['healthy'] for member in members),
+            'hedges': self._hedger.stats if self._hedger is not None else None,
+            'identities': members
+        }
+
+    async def close(self):
+        await asyncio.gather(*(member.lens.close() for member in self.members))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
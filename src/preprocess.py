@@ -0,0 +1,171 @@
+import io
+from .consts import SUPPORTED_MIMES
+
+# PIL, filetype and the optimizer are imported by the functions that decode,
+# importing the package alone stays cheap
+
+# Google Lens does not accept images larger than 1000x1000
+MAX_DIMENSION = 1000
+
+class PreparedImage:
+    def __init__(self, data, mime, dimensions, original_dimensions, bytes_saved=0):
+        self.data = data
+        self.mime = mime
+        self.dimensions = dimensions
+        self.original_dimensions = original_dimensions
+        # upload bytes the optimizer saved against the plain encoding
+        self.bytes_saved = bytes_saved
+
+class BufferReader(io.RawIOBase):
+    # seekable file object over any buffer (mmap views included) that reads in
+    # place, io.BytesIO would copy everything that isn't a bytes object
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError('Negative seek position')
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        start = min(self._position, len(self._view))
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._position = end
+        return self._view[start:end].tobytes()
+
+    def readinto(self, target):
+        data = self.read(len(target))
+        target[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+def open_buffer(buffer):
+    # io.BytesIO shares a bytes object without copying it
+    if isinstance(buffer, bytes):
+        return io.BytesIO(buffer)
+    return BufferReader(buffer)
+
+def probe_dimensions(buffer):
+    from PIL import Image
+
+    # Image.open only parses the header, pixel data is not decoded here
+    with Image.open(open_buffer(buffer)) as image:
+        return list(image.size)
+
+def fit_dimensions(dimensions, max_dimension=MAX_DIMENSION):
+    width, height = dimensions
+    scale = min(max_dimension / width, max_dimension / height, 1)
+    return [max(1, round(width * scale)), max(1, round(height * scale))]
+
+def flatten(image):
+    # jpeg has no alpha channel, transparent areas become white instead of black
+    if image.mode in ('RGB', 'L'):
+        return image
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        from PIL import Image
+
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def downscale(image, max_dimension=MAX_DIMENSION):
+    target = fit_dimensions(image.size, max_dimension)
+
+    # let the jpeg decoder skip straight to the nearest 1/2, 1/4 or 1/8 scale
+    if image.format == 'JPEG':
+        image.draft('RGB', tuple(target))
+
+    image = flatten(image)
+
+    # cheap integer box reduction first, the final resize then works on a small image
+    factor = min(image.size[0] // target[0], image.size[1] // target[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    if list(image.size) != target:
+        from PIL import Image
+
+        image = image.resize(tuple(target), Image.LANCZOS)
+
+    return image
+
+def encode_jpeg(image):
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90, progressive=True)
+    return output.getvalue()
+
+def prepare_image(buffer, max_dimension=MAX_DIMENSION, optimize=None):
+    from PIL import Image
+    from filetype import guess_mime
+    from . import optimizer
+
+    mime = guess_mime(buffer)
+
+    if not mime:
+        raise ValueError('File type not supported')
+
+    options = optimizer.resolve_options(optimize)
+    image = Image.open(open_buffer(buffer))
+    original_dimensions = list(image.size)
+
+    # already acceptable, upload the original bytes without decoding them
+    if mime in SUPPORTED_MIMES and max(original_dimensions) <= max_dimension:
+        if options is None or len(buffer) < options['minBytes']:
+            image.close()
+            return PreparedImage(buffer, mime, original_dimensions, original_dimensions)
+
+        with image:
+            result = optimizer.optimize(flatten(image), buffer, mime, options)
+        return PreparedImage(result.data, result.mime, original_dimensions, original_dimensions, result.bytes_saved)
+
+    with image:
+        resized = downscale(image, max_dimension)
+        data = encode_jpeg(resized)
+        dimensions = list(resized.size)
+        if options is None:
+            return PreparedImage(data, 'image/jpeg', dimensions, original_dimensions)
+
+        result = optimizer.optimize(resized, data, 'image/jpeg', options)
+
+    return PreparedImage(result.data, result.mime, dimensions, original_dimensions, result.bytes_saved)
+
+def decode_image(buffer):
+    # flattened and fully loaded, tiles are cropped from it without decoding again
+    from PIL import Image
+
+    with Image.open(open_buffer(buffer)) as image:
+        image.load()
+        flat = flatten(image)
+        # closing the file frees an image flatten returned unchanged
+        return flat.copy() if flat is image else flat
+
+def encode_tile(source, tile):
+    # source is a decoded image, or the original buffer in a worker process,
+    # where a decoded image would be pickled for every tile
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        from PIL import Image
+
+        with Image.open(open_buffer(source)) as image:
+            return encode_jpeg(flatten(image).crop(tile))
+    return encode_jpeg(source.crop(tile))
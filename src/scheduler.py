@@ -0,0 +1,127 @@
+import time
+import random
+import asyncio
+import contextlib
+
+# statuses that mean lens wants us to slow down
+BACKOFF_STATUSES = (302, 429, 500, 502, 503, 504)
+# statuses worth sending again after a pause, 302 goes through the consent flow instead
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class Scheduler:
+    # token bucket + in-flight cap, with the bucket rate adapted aimd-style:
+    # additive increase on success, multiplicative decrease when throttled
+    def __init__(self, rate=5.0, burst=5, max_in_flight=8, min_rate=0.2, max_rate=20.0, increase=0.5, decrease=0.5, decrease_interval=1.0, retries=3, backoff_base=0.5, backoff_max=30.0):
+        if rate <= 0 or min_rate <= 0 or max_rate < min_rate:
+            raise ValueError('Rates must be positive and max_rate must not be below min_rate')
+
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.retried = 0
+        self.throttled = 0
+
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._last_decrease = float('-inf')
+        self._loop = None
+        self._lock = None
+        self._slots = None
+
+    def _bind(self):
+        # asyncio primitives belong to one loop, recreate them if the process moved to another
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    async def acquire(self):
+        self._bind()
+        self.queue_depth += 1
+        try:
+            await self._slots.acquire()
+            try:
+                async with self._lock:
+                    self._refill()
+                    while self._tokens < 1:
+                        await asyncio.sleep((1 - self._tokens) / self.rate)
+                        self._refill()
+                    self._tokens -= 1
+            except BaseException:
+                self._slots.release()
+                raise
+        finally:
+            self.queue_depth -= 1
+
+        self.in_flight += 1
+
+    def release(self, status=None):
+        self.in_flight -= 1
+        self._slots.release()
+        self.record(status)
+
+    def record(self, status):
+        if status == 200:
+            # successes arrive about rate times per second, so this adds ~increase per second
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1))
+            return
+
+        if status is None or status in BACKOFF_STATUSES:
+            self.throttled += 1
+            now = time.monotonic()
+            # a burst of failures from requests sent together only counts once
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        # status stays 0 (ignored by record) if the request was cancelled
+        outcome = {'status': 0}
+        try:
+            yield outcome
+        finally:
+            self.release(outcome['status'])
+
+    def should_retry(self, status, attempt):
+        return attempt < self.retries and (status is None or status in RETRY_STATUSES)
+
+    def backoff(self, attempt):
+        # full jitter, so retries from parallel requests spread out
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @property
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'retried': self.retried,
+            'throttled': self.throttled
+        }
+
+_default_scheduler = None
+
+def default_scheduler():
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = Scheduler()
+    return _default_scheduler
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+# nothing is cached until a scan finishes, so identical scans started at the
+# same moment would all upload. the first one runs, the others wait for it
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.joined = 0
+        self._calls = {}
+        self._waiters = {}
+
+    async def do(self, key, factory):
+        # factory() is only called when no call with this key is in flight.
+        # every caller gets the same result or exception; a cancelled caller
+        # stops waiting but the shared call keeps running for the others,
+        # until the last one is gone
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.leaders += 1
+        else:
+            self.joined += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                # nobody is left for the result, stop the upload. a caller
+                # arriving now must not join a call that is being cancelled
+                if not task.done():
+                    task.cancel()
+                    if self._calls.get(key) is task:
+                        del self._calls[key]
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # every waiter may have been cancelled, don't warn about an unretrieved error
+        if not task.cancelled():
+            task.exception()
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    @property
+    def in_flight(self):
+        return len(self._calls)
+
+    @property
+    def stats(self):
+        return {
+            'leaders': self.leaders,
+            'joined': self.joined,
+            'inFlight': self.in_flight
+        }
+
+def data_key(data, mime, original_dimensions):
+    # the result's pixel coordinates depend on the original dimensions too
+    return ('data', hashlib.sha256(data).hexdigest(), mime, tuple(original_dimensions))
+
+def normalize_url(url):
+    # scheme and host are case-insensitive, default ports and fragments never reach the server
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    if parts.username is not None:
+        credentials = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        host = f'{credentials}@{host}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+def url_key(url, dimensions):
+    return ('url', normalize_url(url), tuple(dimensions))
@@ -0,0 +1,79 @@
+import math
+from collections import Counter
+
+def _axis_positions(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+
+    stride = tile_size - overlap
+    count = math.ceil((length - overlap) / stride)
+    # spread the tiles evenly so the last one ends exactly at the edge
+    step = (length - tile_size) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+def plan_tiles(width, height, tile_size=1000, overlap=100):
+    if tile_size > 1000:
+        raise ValueError('Tile size can not be larger than 1000')
+    if not 0 <= overlap < tile_size:
+        raise ValueError('Overlap must be between 0 and tile size')
+
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in _axis_positions(height, tile_size, overlap)
+        for left in _axis_positions(width, tile_size, overlap)
+    ]
+
+def _overlap_ratio(a, b):
+    # intersection over the smaller box, so a segment cut at a tile edge
+    # still matches its complete copy from the neighbouring tile
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0
+    smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+    return (width * height) / smaller if smaller > 0 else 0
+
+def _same_text(a, b):
+    a = ' '.join(a.split())
+    b = ' '.join(b.split())
+    return a in b or b in a
+
+def _edge_distance(box, tile):
+    # how far the segment stays from the inner edges of its tile
+    return min(box[0] - tile[0], box[1] - tile[1], tile[2] - box[2], tile[3] - box[3])
+
+def merge_tile_segments(tile_segments, threshold=0.5):
+    # tile_segments: (text, [x0, y0, x1, y1] in image pixels, tile box)
+    # keeps one copy of every segment that was read in several overlapping tiles
+    ordered = sorted(tile_segments, key=lambda item: item[1][1])
+    kept = []
+    active = []
+
+    for text, box, tile in ordered:
+        active = [index for index in active if kept[index][1][3] > box[1]]
+
+        duplicate = None
+        for index in active:
+            other_text, other_box, _ = kept[index]
+            if _overlap_ratio(box, other_box) >= threshold and _same_text(text, other_text):
+                duplicate = index
+                break
+
+        if duplicate is None:
+            active.append(len(kept))
+            kept.append((text, box, tile))
+            continue
+
+        other_text, other_box, other_tile = kept[duplicate]
+        # prefer the longer reading, then the copy that is further from a tile border
+        if (len(text.strip()), _edge_distance(box, tile)) > (len(other_text.strip()), _edge_distance(other_box, other_tile)):
+            kept[duplicate] = (text, box, tile)
+
+    return kept
+
+def majority_language(results):
+    counts = Counter()
+    for result in results:
+        if result.language:
+            counts[result.language] += max(len(result.segments), 1)
+    return counts.most_common(1)[0][0] if counts else None
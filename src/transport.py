@@ -0,0 +1,171 @@
+import codecs
+import asyncio
+from collections import deque
+
+class Transport:
+    # long-lived replacement for global_fetch, keeps one connection pool alive
+    # so repeated scans reuse the same TCP+TLS connection to lens.google.com
+    allowed_properties = ["endpoint", "method", "headers", "body", "redirect"]
+
+    def __init__(self, limit=100, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60, timeout=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session = None
+        self._lock = None
+        # bodies still being drained after stream() returned early
+        self._draining = set()
+
+    @property
+    def closed(self):
+        return self._session is None or self._session.closed
+
+    async def _get_session(self):
+        if not self.closed:
+            return self._session
+
+        # sessions have to be created inside a running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self.closed:
+                # imported with the first request, not with the package
+                import aiohttp
+
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.ttl_dns_cache,
+                    keepalive_timeout=self.keepalive_timeout
+                )
+                timeout = aiohttp.ClientTimeout(total=self.timeout)
+                # cookies are managed by LensCore, the session must not keep its own
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=timeout,
+                    cookie_jar=aiohttp.DummyCookieJar()
+                )
+
+        return self._session
+
+    def _request_args(self, request_init):
+        for key in request_init:
+            if key not in self.allowed_properties:
+                raise ValueError(f"Unsupported property '{key}' found in request_init")
+
+        method = request_init.get('method', 'GET').upper()
+        kwargs = {
+            'headers': request_init.get('headers'),
+            'data': request_init.get('body'),
+            'allow_redirects': request_init.get('redirect', 'follow') == 'follow'
+        }
+        return method, kwargs
+
+    async def fetch(self, url, request_init):
+        method, kwargs = self._request_args(request_init)
+
+        session = await self._get_session()
+        async with session.request(method, url, **kwargs) as response:
+            # non-200 statuses are turned into LensError by LensCore, so they are not raised here
+            body = await response.read()
+            return dict(status = response.status, headers = dict(response.headers), cookies = response.cookies, text = await response.text(), received = len(body))
+
+    async def stream(self, url, request_init, scanner, chunk_size=64 * 1024, drain_limit=256 * 1024, tail_limit=64 * 1024):
+        # like fetch, but a 200 body is decoded chunk by chunk into scanner.feed()
+        # and the response is returned as soon as the scanner has its value.
+        # value holds what the scanner found, text the whole body for other
+        # statuses and its last tail_limit characters for a 200 (error bodies).
+        # a page the scanner can't parse is returned with the message in error
+        method, kwargs = self._request_args(request_init)
+
+        session = await self._get_session()
+        response = await session.request(method, url, **kwargs)
+        result = dict(status = response.status, headers = dict(response.headers), cookies = response.cookies, text = None, value = None, received = 0)
+
+        try:
+            if response.status != 200:
+                result['received'] = len(await response.read())
+                result['text'] = await response.text()
+                response.release()
+                return result
+
+            decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')('replace')
+            tail = deque()
+            kept = 0
+            async for chunk in response.content.iter_chunked(chunk_size):
+                result['received'] += len(chunk)
+                text = decoder.decode(chunk)
+                tail.append(text)
+                kept += len(text)
+                while kept - len(tail[0]) >= tail_limit:
+                    kept -= len(tail.popleft())
+
+                try:
+                    result['value'] = scanner.feed(text)
+                except ValueError as e:
+                    result['error'] = str(e)
+                    break
+                if result['value'] is not None:
+                    break
+            else:
+                try:
+                    scanner.feed(decoder.decode(b'', True))
+                    result['value'] = scanner.finish()
+                except ValueError as e:
+                    result['error'] = str(e)
+                result['text'] = ''.join(tail)[-tail_limit:]
+                response.release()
+                return result
+        except BaseException:
+            response.close()
+            raise
+
+        result['text'] = ''.join(tail)[-tail_limit:]
+
+        # found early: the rest is drained in the background so the connection
+        # goes back to the pool, unless it is long enough that reconnecting is cheaper
+        task = asyncio.ensure_future(self._drain(response, drain_limit))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+        return result
+
+    @staticmethod
+    async def _drain(response, limit):
+        import aiohttp
+
+        drained = 0
+        try:
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                drained += len(chunk)
+                if drained > limit:
+                    response.close()
+                    return
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            response.close()
+            return
+        except asyncio.CancelledError:
+            response.close()
+            raise
+        response.release()
+
+    async def __call__(self, url, request_init):
+        return await self.fetch(url, request_init)
+
+    async def close(self):
+        for task in list(self._draining):
+            task.cancel()
+        if not self.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
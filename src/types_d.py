@@ -1,6 +1,5 @@
 from typing import List, Dict, Tuple, Union
 from dataclasses import dataclass
-import aiohttp
 
 LENS_ENDPOINT = 'https://lens.google.com/v3/upload'
 LENS_API_ENDPOINT = 'https://lens.google.com/uploadbyurl'
@@ -25,6 +24,8 @@ MIME_TO_EXT = {
 }
 
 async def global_fetch(url, request_init):
+    import aiohttp
+
     allowed_properties = ["endpoint", "method", "headers", "body", "redirect"]
     for key in request_init:
         if key not in allowed_properties:
@@ -37,7 +38,7 @@ async def global_fetch(url, request_init):
     if 'body' in request_init:
         kwargs['data'] = request_init['body'] # Use 'data' for body in aiohttp
     if 'redirect' in request_init:
-        if request_init['redirect'] != "follow"
+        if request_init['redirect'] != "follow":
             kwargs['allow_redirects'] = False
     async with aiohttp.ClientSession() as session:
         async with session.request(method, url, **kwargs) as response:
@@ -1,4 +1,6 @@
-import time
+import re
+import mmap
+import asyncio
 
 def parse_cookies(cookies):
     return {
@@ -17,3 +19,12 @@ def replace_keys(text):
 async def sleep(ms):
     await asyncio.sleep(ms / 1000)
 
+def map_file(path):
+    # read-only memory map of the whole file, pages are read on first access and
+    # unmapped when the last view is gone. None for empty or unmappable files (pipes)
+    with open(path, 'rb') as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+    return memoryview(mapped)
@@ -0,0 +1,25 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.core import LensError
+from src.index import Lens
+from src.transport import Transport
+from bench.server import StandInServer, local_fetch
+
+MALFORMED_PAGE = "<html><script nonce=\"x\">AF_initDataCallback({key: 'ds:0', data: foo, sideChannel: 'DetectedObject'});</script></html>"
+
+async def scan_malformed(stream_response):
+    async with StandInServer([MALFORMED_PAGE]) as server, Transport() as transport:
+        config = {'scheduler': None, 'coalesce': False, 'streamResponse': stream_response}
+        async with Lens(config, local_fetch(transport, server.url)) as lens:
+            await lens.scan_by_url('https://example.com/image.png', [100, 100])
+
+@pytest.mark.parametrize('stream_response', [True, False])
+def test_malformed_page_raises_lens_error(stream_response):
+    with pytest.raises(LensError, match='Could not parse response: Unexpected identifier "foo"'):
+        asyncio.run(scan_malformed(stream_response))